@@ -0,0 +1,267 @@
+"""
+Local stand-in for the offers API, with configurable latency, failures,
+token expiry and offer churn, to load test the sync of booth on one machine.
+
+    python -m benchmarks.offers_simulator --port 5001 --latency-mean-ms 150 --error-rate 0.01
+
+Point booth to it with OFFERS_BASEURL=http://localhost:5001. Request counts
+by endpoint and status, and issued tokens, are served at GET /stats.
+"""
+
+import argparse
+import base64
+from collections import Counter
+import json
+import random
+import threading
+import time
+from uuid import uuid4
+
+from flask import Flask, jsonify, request
+from werkzeug.serving import run_simple
+
+
+def _b64(data: dict):
+    return base64.urlsafe_b64encode(json.dumps(data).encode("utf-8")).rstrip(b"=").decode("ascii")
+
+
+def make_token(ttl_seconds):
+    """
+    Returns an unsigned JWT expiring after ttl_seconds.
+    """
+    header = _b64({"alg": "none", "typ": "JWT"})
+    payload = _b64({"jti": str(uuid4()), "exp": int(time.time()) + ttl_seconds})
+    return f"{header}.{payload}."
+
+
+class Simulator:
+    def __init__(
+        self,
+        refresh_token=None,
+        token_ttl_seconds=300,
+        latency_distribution="fixed",
+        latency_mean_ms=0.0,
+        latency_stddev_ms=0.0,
+        error_rate=0.0,
+        unauthorized_rate=0.0,
+        min_offers=1,
+        max_offers=10,
+        churn_rate=0.1,
+        payload_padding=0,
+        seed=None,
+    ):
+        """
+        :param refresh_token: refresh token accepted by the auth endpoint, any if None
+        :param token_ttl_seconds: seconds after which the access tokens expire
+        :param latency_distribution: fixed, uniform, normal or lognormal
+        :param error_rate: fraction of the requests failing with 500
+        :param unauthorized_rate: fraction of the authenticated requests
+            failing with 401 even with a valid token
+        :param min_offers: minimum number of offers per product
+        :param max_offers: maximum number of offers per product
+        :param churn_rate: probability for each offer to change price, to be
+            removed, or to be joined by a new offer at each request
+        :param payload_padding: bytes of padding added to each offer
+        """
+        self.refresh_token = refresh_token
+        self.token_ttl_seconds = token_ttl_seconds
+        self.latency_distribution = latency_distribution
+        self.latency_mean_ms = latency_mean_ms
+        self.latency_stddev_ms = latency_stddev_ms
+        self.error_rate = error_rate
+        self.unauthorized_rate = unauthorized_rate
+        self.min_offers = min_offers
+        self.max_offers = max_offers
+        self.churn_rate = churn_rate
+        self.padding = "x" * payload_padding
+        self.random = random.Random(seed)
+        self.tokens = {}
+        self.products = {}
+        self.stats = Counter()
+        self._lock = threading.Lock()
+
+    def latency_seconds(self):
+        mean, stddev = self.latency_mean_ms, self.latency_stddev_ms
+        with self._lock:
+            match self.latency_distribution:
+                case "uniform":
+                    latency = self.random.uniform(mean - stddev, mean + stddev)
+                case "normal":
+                    latency = self.random.gauss(mean, stddev)
+                case "lognormal":
+                    latency = mean * self.random.lognormvariate(0, stddev / mean if mean else 0)
+                case _:
+                    latency = mean
+        return max(latency, 0) / 1000
+
+    def chance(self, rate):
+        with self._lock:
+            return self.random.random() < rate
+
+    def record(self, endpoint, status):
+        with self._lock:
+            self.stats[f"{endpoint} {status}"] += 1
+
+    def issue_token(self):
+        token = make_token(self.token_ttl_seconds)
+        with self._lock:
+            self.tokens[token] = time.time() + self.token_ttl_seconds
+            self.stats["tokens issued"] += 1
+        return token
+
+    def is_authorized(self, token):
+        with self._lock:
+            expires_at = self.tokens.get(token)
+        return expires_at is not None and expires_at > time.time()
+
+    def new_offer(self):
+        return {
+            "id": str(uuid4()),
+            "price": self.random.randint(100, 10000),
+            "items_in_stock": self.random.randint(0, 100),
+        }
+
+    def register(self, product_id):
+        with self._lock:
+            self.products[product_id] = [
+                self.new_offer()
+                for _ in range(self.random.randint(self.min_offers, self.max_offers))
+            ]
+
+    def get_offers(self, product_id):
+        """
+        :return: the offers of the product after applying the churn, None if
+            the product is not registered
+        """
+        with self._lock:
+            offers = self.products.get(product_id)
+            if offers is None:
+                return None
+            churned, removed = [], 0
+            for offer in offers:
+                if (
+                    self.random.random() < self.churn_rate
+                    and len(offers) - removed > self.min_offers
+                ):
+                    removed += 1
+                    continue
+                if self.random.random() < self.churn_rate:
+                    offer = {**offer, "price": self.random.randint(100, 10000)}
+                churned.append(offer)
+            if self.random.random() < self.churn_rate and len(churned) < self.max_offers:
+                churned.append(self.new_offer())
+            self.products[product_id] = churned
+        if self.padding:
+            return [{**offer, "padding": self.padding} for offer in churned]
+        return churned
+
+
+def create_simulator_app(simulator: Simulator):
+    app = Flask(__name__)
+
+    def respond(endpoint, authenticated=True):
+        """
+        Applies latency and failure injection, returning an error response
+        or None if the request can be served.
+        """
+        time.sleep(simulator.latency_seconds())
+        if simulator.chance(simulator.error_rate):
+            simulator.record(endpoint, 500)
+            return "Simulated error", 500
+        if authenticated and (
+            not simulator.is_authorized(request.headers.get("Bearer"))
+            or simulator.chance(simulator.unauthorized_rate)
+        ):
+            simulator.record(endpoint, 401)
+            return "Bad authentication", 401
+        return None
+
+    @app.post("/api/v1/auth")
+    def auth():
+        error = respond("auth", authenticated=False)
+        if error:
+            return error
+        refresh_token = request.headers.get("Bearer")
+        if simulator.refresh_token is not None and refresh_token != simulator.refresh_token:
+            simulator.record("auth", 401)
+            return "Bad refresh token", 401
+        simulator.record("auth", 201)
+        return jsonify({"access_token": simulator.issue_token()}), 201
+
+    @app.post("/api/v1/products/register")
+    def register():
+        error = respond("register")
+        if error:
+            return error
+        product_id = request.get_json()["id"]
+        simulator.register(product_id)
+        simulator.record("register", 201)
+        return jsonify({"id": product_id}), 201
+
+    @app.get("/api/v1/products/<product_id>/offers")
+    def offers(product_id):
+        error = respond("offers")
+        if error:
+            return error
+        offers = simulator.get_offers(product_id)
+        if offers is None:
+            # Unknown products are registered on the fly, e.g. after a restart
+            simulator.register(product_id)
+            offers = simulator.get_offers(product_id)
+        simulator.record("offers", 200)
+        return jsonify(offers)
+
+    @app.get("/stats")
+    def stats():
+        with simulator._lock:
+            return jsonify(dict(simulator.stats))
+
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--refresh-token", help="accepted refresh token, any if unset")
+    parser.add_argument("--token-ttl-seconds", type=int, default=300)
+    parser.add_argument(
+        "--latency-distribution",
+        choices=("fixed", "uniform", "normal", "lognormal"),
+        default="fixed",
+    )
+    parser.add_argument("--latency-mean-ms", type=float, default=0)
+    parser.add_argument("--latency-stddev-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--unauthorized-rate", type=float, default=0)
+    parser.add_argument("--min-offers", type=int, default=1)
+    parser.add_argument("--max-offers", type=int, default=10)
+    parser.add_argument("--churn-rate", type=float, default=0.1)
+    parser.add_argument(
+        "--payload-padding", type=int, default=0, help="bytes of padding per offer"
+    )
+    parser.add_argument("--seed", type=int)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    simulator = Simulator(
+        refresh_token=args.refresh_token,
+        token_ttl_seconds=args.token_ttl_seconds,
+        latency_distribution=args.latency_distribution,
+        latency_mean_ms=args.latency_mean_ms,
+        latency_stddev_ms=args.latency_stddev_ms,
+        error_rate=args.error_rate,
+        unauthorized_rate=args.unauthorized_rate,
+        min_offers=args.min_offers,
+        max_offers=args.max_offers,
+        churn_rate=args.churn_rate,
+        payload_padding=args.payload_padding,
+        seed=args.seed,
+    )
+    run_simple(args.host, args.port, create_simulator_app(simulator), threaded=True)
+
+
+if __name__ == "__main__":
+    main()
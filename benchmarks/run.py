@@ -0,0 +1,281 @@
+"""
+Benchmarks the offers sync, the price history and the read views against
+synthetic catalogues in a temporary SQLite database, with the offers API
+mocked so that they run offline.
+
+Run from the repository root, with the test dependencies installed:
+
+    python -m benchmarks.run --sizes 1000,10000 --output results.json
+    python -m benchmarks.run --baseline results.json
+    python -m benchmarks.run --offers-url http://localhost:5001
+
+Compared to a baseline, the run exits with status 1 if the median of any
+benchmark regressed by more than the threshold.
+"""
+
+import argparse
+from datetime import datetime, timezone
+import json
+import logging
+import os
+import platform
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+from flask_apscheduler import APScheduler
+import requests_mock
+from werkzeug.security import generate_password_hash
+
+from booth import create_app, db, scheduler as booth_scheduler
+
+
+OFFERS_BASEURL = "http://offers.benchmark"
+USERNAME = "benchmark"
+PASSWORD = "benchmark"
+
+
+class OffersService:
+    """
+    Mocked offers API returning offers_per_product offers for each product,
+    a churn fraction of them with a new price at each call.
+    """
+
+    def __init__(self, offers_per_product, churn, seed):
+        self.offers_per_product = offers_per_product
+        self.churn = churn
+        self.random = random.Random(seed)
+
+    def get_offers(self, request, context):
+        product_id = re.search(r"/products/([^/]+)/offers", request.path)[1]
+        context.status_code = 200
+        return [
+            {
+                "id": f"{product_id}-{i}",
+                "price": 100 + i
+                + (self.random.randint(1, 50) if self.random.random() < self.churn else 0),
+                "items_in_stock": 10 + i,
+            }
+            for i in range(self.offers_per_product)
+        ]
+
+    def mock(self, mocker):
+        mocker.get(
+            re.compile(re.escape(OFFERS_BASEURL) + r"/api/v1/products/.+/offers"),
+            json=self.get_offers,
+        )
+
+
+def seed_database(app, products, offers_per_product, history_records):
+    with app.app_context():
+        db.init_db()
+        connection = db.get_db()
+        connection.execute(
+            "INSERT INTO users (username, password) VALUES (?, ?)",
+            (USERNAME, generate_password_hash(PASSWORD)),
+        )
+        connection.executemany(
+            "INSERT INTO products (id, name, description) VALUES (?, ?, ?)",
+            (
+                (f"p{i}", f"Product {i:07d}", f"Description of product {i}.")
+                for i in range(products)
+            ),
+        )
+        connection.executemany(
+            "INSERT INTO offers (id, product_id, price, items_in_stock) VALUES (?, ?, ?, ?)",
+            (
+                (f"p{i}-{j}", f"p{i}", 100 + j, 10 + j)
+                for i in range(products)
+                for j in range(offers_per_product)
+            ),
+        )
+        now = int(time.time())
+        connection.executemany(
+            "INSERT INTO price_history (timestamp, product_id, mean_price, min_price)"
+            " VALUES (?, ?, ?, ?)",
+            (
+                (now - (history_records - k) * 60, f"p{i}", 150.0, 100)
+                for i in range(products)
+                for k in range(history_records)
+            ),
+        )
+        connection.commit()
+
+
+def measure(func, repeat, setup=None):
+    """
+    :return: the min and the median of the durations in seconds of repeat calls
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return {"min": min(durations), "median": statistics.median(durations)}
+
+
+def run_size(products, args):
+    folder = tempfile.mkdtemp(prefix="booth-benchmark-")
+    app = create_app(
+        {
+            "TESTING": True,
+            "DATABASE": os.path.join(folder, "db.sqlite"),
+            "OFFERS_BASEURL": args.offers_url or OFFERS_BASEURL,
+            "OFFERS_REFRESH_TOKEN": "benchmark-refresh-token",
+            "OFFERS_ACCESS_TOKEN": "benchmark-access-token",
+            "OFFERS_ACCESS_TOKEN_PATH": os.path.join(folder, "offers_access_token.json"),
+            "OFFERS_SYNC_CONCURRENCY": str(args.concurrency),
+            "OFFERS_SYNC_SLICES": "1",
+            "OFFERS_MEMO_TTL_SECONDS": "0",
+        }
+    )
+    app.logger.setLevel(logging.WARNING)
+    seed_database(app, products, args.offers, args.history)
+
+    scheduler = APScheduler()
+    scheduler.init_app(app)
+    service = OffersService(args.offers, args.churn, args.seed)
+    client = app.test_client()
+    client.post("/auth/login", data={"username": USERNAME, "password": PASSWORD})
+    clear_response_cache = app.extensions["response_cache"].clear
+    product_id = f"p{products // 2}"
+
+    results = {}
+    try:
+        if args.offers_url:
+            results["sync_offers"] = measure(
+                lambda: booth_scheduler.sync_offers(scheduler), args.repeat
+            )
+        else:
+            with requests_mock.Mocker() as mocker:
+                service.mock(mocker)
+                results["sync_offers"] = measure(
+                    lambda: booth_scheduler.sync_offers(scheduler), args.repeat
+                )
+        results["update_price_history"] = measure(
+            lambda: booth_scheduler.update_price_history(scheduler), args.repeat
+        )
+
+        def get_price_history():
+            with app.app_context():
+                db.get_price_history(product_id)
+
+        results["get_price_history"] = measure(get_price_history, args.repeat)
+        results["render_index"] = measure(
+            lambda: client.get("/"), args.repeat, setup=clear_response_cache
+        )
+        results["render_index_cached"] = measure(lambda: client.get("/"), args.repeat)
+        results["render_history"] = measure(
+            lambda: client.get(f"/{product_id}/history"),
+            args.repeat,
+            setup=clear_response_cache,
+        )
+    finally:
+        with app.app_context():
+            db.close_pool()
+        for file in os.listdir(folder):
+            os.unlink(os.path.join(folder, file))
+        os.rmdir(folder)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    :return: the benchmarks whose median regressed by more than threshold
+    """
+    regressions = []
+    for size, benchmarks in results.items():
+        for name, result in benchmarks.items():
+            previous = baseline.get("results", {}).get(size, {}).get(name)
+            if not previous or not previous["median"]:
+                continue
+            ratio = result["median"] / previous["median"]
+            if ratio > 1 + threshold:
+                regressions.append((size, name, previous["median"], result["median"], ratio))
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="comma separated numbers of products of the catalogues",
+    )
+    parser.add_argument("--offers", type=int, default=5, help="offers per product")
+    parser.add_argument(
+        "--history", type=int, default=10, help="price records per product"
+    )
+    parser.add_argument(
+        "--churn", type=float, default=0.1, help="fraction of offers changing price at each sync"
+    )
+    parser.add_argument(
+        "--offers-url",
+        help="URL of a running offers API, e.g. benchmarks.offers_simulator, instead of the mock",
+    )
+    parser.add_argument("--concurrency", type=int, default=8, help="sync concurrency")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the offers churn")
+    parser.add_argument("--output", help="file the JSON results are written to")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare to")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="relative slowdown of a median flagged as a regression",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "offers": args.offers,
+            "history": args.history,
+            "churn": args.churn,
+            "concurrency": args.concurrency,
+            "offers_url": args.offers_url,
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    for size in [int(size) for size in args.sizes.split(",")]:
+        print(f"Benchmarking {size} products...", file=sys.stderr)
+        report["results"][str(size)] = results = run_size(size, args)
+        for name, result in results.items():
+            print(
+                f"  {name}: median {result['median'] * 1000:.1f} ms, min {result['min'] * 1000:.1f} ms",
+                file=sys.stderr,
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        for size, name, previous, current, ratio in regressions:
+            print(
+                f"Regression: {name} with {size} products, median {previous * 1000:.1f} ms -> {current * 1000:.1f} ms ({ratio:.2f}x)",
+                file=sys.stderr,
+            )
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,3 @@
-import json
 import os
 
 from flask import Flask
@@ -16,37 +15,118 @@ def read_config_from_file(app, name):
             app.config.update({name: f.read().rstrip('\n')})
 
 
+def read_int_config(app, name, default):
+    try:
+        return int(app.config[name])
+    except Exception:
+        app.logger.error(
+            f"Error parsing {name}: {app.config.get(name)}, using default of {default}"
+        )
+        return default
+
+
 def create_app(test_config=None):
     app = Flask(__name__, instance_relative_config=True)
     app.logger.setLevel("INFO")
     app.config.from_mapping(
         SECRET_KEY="dev",
         DATABASE=os.path.join(app.instance_path, "db.sqlite"),
+        DATABASE_POOL="true",
+        SQLITE_JOURNAL_MODE="WAL",
+        SQLITE_SYNCHRONOUS="NORMAL",
+        SQLITE_MMAP_SIZE="268435456",
+        SQLITE_CACHE_SIZE="-16000",
+        SQLITE_BUSY_TIMEOUT_MS="5000",
         OFFERS_BASEURL="",
         OFFERS_REFRESH_TOKEN="",
         OFFERS_ACCESS_TOKEN="",
+        OFFERS_ACCESS_TOKEN_PATH="",
+        OFFERS_TOKEN_REFRESH_MARGIN_SECONDS="60",
         OFFERS_SYNC_INTERVAL_SECONDS="60",
+        OFFERS_SYNC_CONCURRENCY="8",
+        OFFERS_SYNC_SLICES="10",
+        OFFERS_SYNC_JITTER_SECONDS="1",
+        OFFERS_POOL_SIZE="10",
+        OFFERS_CONNECT_TIMEOUT_SECONDS="5",
+        OFFERS_READ_TIMEOUT_SECONDS="30",
+        OFFERS_COMPRESSION="true",
+        OFFERS_MEMO_TTL_SECONDS="2",
+        OFFERS_MEMO_SIZE="1024",
         UPDATE_PRICE_HISTORY_INTERVAL_SECONDS="60",
-        MAX_PRODUCT_RECORDS="100",
+        MAX_PRODUCT_RECORDS="0",
+        PRUNE_PRICE_HISTORY_INTERVAL_SECONDS="300",
+        PRICE_HISTORY_RAW_RETENTION_SECONDS="172800",
+        PRICE_HISTORY_HOURLY_RETENTION_SECONDS="7776000",
+        REGISTRATION_INTERVAL_SECONDS="5",
+        REGISTRATION_BATCH_SIZE="20",
+        REGISTRATION_CONCURRENCY="4",
+        REGISTRATION_RETRY_DELAY_SECONDS="10",
+        REGISTRATION_CLAIM_TIMEOUT_SECONDS="300",
+        REGISTRATION_MAX_ATTEMPTS="5",
+        SCHEDULER_ENABLED="true",
+        SCHEDULER_LEASE_MISSED_RUNS="3",
+        PRODUCTS_PAGE_SIZE="50",
+        HISTORY_LATEST_RECORDS="100",
+        RESPONSE_CACHE_SIZE="256",
+        USER_CACHE_SIZE="1024",
+        USER_CACHE_TTL_SECONDS="60",
+        PROFILING_ENABLED="false",
+        PROFILING_SAMPLE_RATE="0.01",
+        PROFILING_TOP_N="30",
+        PROFILING_FOLDER="",
         SECRET_KEY_FILE="",
         OFFERS_REFRESH_TOKEN_FILE="",
     )
 
     if test_config is None:
-        # Load access token from a previous session
-        app.config.from_file("offers_access_token.json", load=json.load, silent=True)
-
         # Load variables from instance file
         app.config.from_pyfile("config.py", silent=True)
 
         # Load variables directly from environment
         read_config_from_env(app, "SECRET_KEY")
+        read_config_from_env(app, "DATABASE_POOL")
+        read_config_from_env(app, "SQLITE_JOURNAL_MODE")
+        read_config_from_env(app, "SQLITE_SYNCHRONOUS")
+        read_config_from_env(app, "SQLITE_MMAP_SIZE")
+        read_config_from_env(app, "SQLITE_CACHE_SIZE")
+        read_config_from_env(app, "SQLITE_BUSY_TIMEOUT_MS")
         read_config_from_env(app, "OFFERS_BASEURL")
         read_config_from_env(app, "OFFERS_REFRESH_TOKEN")
         read_config_from_env(app, "OFFERS_ACCESS_TOKEN")
+        read_config_from_env(app, "OFFERS_ACCESS_TOKEN_PATH")
+        read_config_from_env(app, "OFFERS_TOKEN_REFRESH_MARGIN_SECONDS")
         read_config_from_env(app, "OFFERS_SYNC_INTERVAL_SECONDS")
+        read_config_from_env(app, "OFFERS_SYNC_CONCURRENCY")
+        read_config_from_env(app, "OFFERS_SYNC_SLICES")
+        read_config_from_env(app, "OFFERS_SYNC_JITTER_SECONDS")
+        read_config_from_env(app, "OFFERS_POOL_SIZE")
+        read_config_from_env(app, "OFFERS_CONNECT_TIMEOUT_SECONDS")
+        read_config_from_env(app, "OFFERS_READ_TIMEOUT_SECONDS")
+        read_config_from_env(app, "OFFERS_COMPRESSION")
+        read_config_from_env(app, "OFFERS_MEMO_TTL_SECONDS")
+        read_config_from_env(app, "OFFERS_MEMO_SIZE")
         read_config_from_env(app, "UPDATE_PRICE_HISTORY_INTERVAL_SECONDS")
         read_config_from_env(app, "MAX_PRODUCT_RECORDS")
+        read_config_from_env(app, "PRUNE_PRICE_HISTORY_INTERVAL_SECONDS")
+        read_config_from_env(app, "PRICE_HISTORY_RAW_RETENTION_SECONDS")
+        read_config_from_env(app, "PRICE_HISTORY_HOURLY_RETENTION_SECONDS")
+        read_config_from_env(app, "REGISTRATION_INTERVAL_SECONDS")
+        read_config_from_env(app, "REGISTRATION_BATCH_SIZE")
+        read_config_from_env(app, "REGISTRATION_CONCURRENCY")
+        read_config_from_env(app, "REGISTRATION_RETRY_DELAY_SECONDS")
+        read_config_from_env(app, "REGISTRATION_CLAIM_TIMEOUT_SECONDS")
+        read_config_from_env(app, "REGISTRATION_MAX_ATTEMPTS")
+        read_config_from_env(app, "SCHEDULER_ENABLED")
+        read_config_from_env(app, "SCHEDULER_LEASE_MISSED_RUNS")
+        read_config_from_env(app, "PRODUCTS_PAGE_SIZE")
+        read_config_from_env(app, "HISTORY_LATEST_RECORDS")
+        read_config_from_env(app, "RESPONSE_CACHE_SIZE")
+        read_config_from_env(app, "USER_CACHE_SIZE")
+        read_config_from_env(app, "USER_CACHE_TTL_SECONDS")
+        read_config_from_env(app, "PROFILING_ENABLED")
+        read_config_from_env(app, "PROFILING_SAMPLE_RATE")
+        read_config_from_env(app, "PROFILING_TOP_N")
+        read_config_from_env(app, "PROFILING_FOLDER")
         read_config_from_env(app, "SECRET_KEY_FILE")
         read_config_from_env(app, "OFFERS_REFRESH_TOKEN_FILE")
     else:
@@ -61,12 +141,34 @@ def create_app(test_config=None):
     read_config_from_file(app, "SECRET_KEY")
     read_config_from_file(app, "OFFERS_REFRESH_TOKEN")
 
-    from . import db, auth, booth, scheduler
+    from . import (
+        db,
+        api,
+        auth,
+        booth,
+        cache,
+        export,
+        importer,
+        metrics,
+        offers,
+        offers_api,
+        profiling,
+        scheduler,
+    )
 
+    metrics.init_app(app)
     db.init_app(app)
+    cache.init_app(app)
+    auth.init_app(app)
+    offers_api.init_app(app)
+    offers.init_app(app)
     app.register_blueprint(auth.bp)
     app.register_blueprint(booth.bp)
+    app.register_blueprint(api.bp)
+    profiling.init_app(app)
     scheduler.init_app(app)
+    importer.init_app(app)
+    export.init_app(app)
     app.add_url_rule("/", endpoint="index")
 
     return app
@@ -0,0 +1,257 @@
+from flask import (
+    Blueprint,
+    Response,
+    g,
+    jsonify,
+    request,
+    stream_with_context,
+)
+import csv
+import io
+import json
+import zlib
+
+from booth import constants, db
+
+
+bp = Blueprint("api", __name__, url_prefix="/api/v1")
+
+PRODUCT_FIELDS = ("id", "name", "description")
+OFFER_FIELDS = ("id", "product_id", "price", "items_in_stock")
+PRICE_HISTORY_FIELDS = ("timestamp", "product_id", "mean_price", "min_price")
+EXPORT_FIELDS = {
+    "products": PRODUCT_FIELDS,
+    "offers": OFFER_FIELDS,
+    "price_history": PRICE_HISTORY_FIELDS,
+}
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# Number of rows serialized into each chunk of a streamed response
+STREAM_CHUNK_ROWS = 500
+
+_encode = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def error_response(error, status_code):
+    return jsonify({"error": error}), status_code
+
+
+@bp.before_request
+def require_login():
+    if g.user is None:
+        return error_response("Authentication required.", 401)
+
+
+def get_fields(allowed_fields):
+    """
+    Reads the projection requested with the fields query argument.
+
+    :return: the requested fields, or None if some of them are not allowed
+    """
+    fields = request.args.get("fields")
+    if not fields:
+        return allowed_fields
+    fields = tuple(field.strip() for field in fields.split(","))
+    if not all(field in allowed_fields for field in fields):
+        return None
+    return fields
+
+
+def wants_ndjson():
+    if "format" in request.args:
+        return request.args["format"] == "ndjson"
+    return (
+        request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+        == "application/x-ndjson"
+    )
+
+
+def generate_json(rows, fields):
+    """
+    Serializes the rows as a JSON array, yielding chunks of STREAM_CHUNK_ROWS rows.
+    """
+    yield "["
+    separator = ""
+    chunk = []
+    for row in rows:
+        chunk.append(_encode(dict(zip(fields, row))))
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield separator + ",".join(chunk)
+            separator = ","
+            chunk = []
+    if chunk:
+        yield separator + ",".join(chunk)
+    yield "]"
+
+
+def generate_ndjson(rows, fields):
+    """
+    Serializes the rows as newline delimited JSON, yielding chunks of
+    STREAM_CHUNK_ROWS rows.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(_encode(dict(zip(fields, row))) + "\n")
+        if len(chunk) == STREAM_CHUNK_ROWS:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def generate_csv(rows, fields):
+    """
+    Serializes the rows as CSV with a header row, yielding chunks of
+    STREAM_CHUNK_ROWS rows.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+        if count == STREAM_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            count = 0
+    yield buffer.getvalue()
+
+
+def generate_gzip(chunks):
+    """
+    Compresses the text chunks into a gzip stream.
+    """
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def generate_export(rows, fields, format, compress=False):
+    """
+    :return: the chunks of the rows serialized to format, csv or ndjson,
+        as bytes if compressed with gzip and as text otherwise
+    """
+    generate = generate_csv if format == "csv" else generate_ndjson
+    chunks = generate(rows, fields)
+    return generate_gzip(chunks) if compress else chunks
+
+
+def stream_rows(read_rows, allowed_fields):
+    """
+    :param read_rows: function receiving the projected fields and returning
+        an error and a cursor on the rows
+    """
+    fields = get_fields(allowed_fields)
+    if fields is None:
+        return error_response(
+            f"Invalid fields, allowed fields are: {', '.join(allowed_fields)}.", 400
+        )
+
+    error, rows = read_rows(fields)
+    if error or rows is None:
+        return error_response(error or "Error retrieving data.", 500)
+
+    db.defer_close_db()
+    if wants_ndjson():
+        return Response(
+            stream_with_context(generate_ndjson(rows, fields)),
+            mimetype="application/x-ndjson",
+        )
+    return Response(
+        stream_with_context(generate_json(rows, fields)),
+        mimetype="application/json",
+    )
+
+
+def check_product(product_id):
+    error, product = db.get_product(product_id)
+    if not product:
+        return None, error_response(
+            error or f"Product id {product_id} does not exist", 404
+        )
+    return product, None
+
+
+@bp.route("/products")
+def products():
+    return stream_rows(lambda fields: db.iter_products(fields), PRODUCT_FIELDS)
+
+
+@bp.route("/products/<product_id>")
+def product(product_id):
+    row, not_found = check_product(product_id)
+    if not_found:
+        return not_found
+    return jsonify(dict(row))
+
+
+@bp.route("/products/<product_id>/offers")
+def offers(product_id):
+    _, not_found = check_product(product_id)
+    if not_found:
+        return not_found
+    return stream_rows(
+        lambda fields: db.iter_product_offers(product_id, fields), OFFER_FIELDS
+    )
+
+
+@bp.route("/products/<product_id>/history")
+def history(product_id):
+    _, not_found = check_product(product_id)
+    if not_found:
+        return not_found
+    since = request.args.get("since", type=int)
+    return stream_rows(
+        lambda fields: db.iter_price_history(product_id, since, fields),
+        PRICE_HISTORY_FIELDS,
+    )
+
+
+@bp.route("/registrations/<product_id>")
+def registration(product_id):
+    error, job = db.get_registration_job(product_id)
+    if not job:
+        return error_response(error or constants.GENERIC_ERROR_MESSAGE, 404)
+    return jsonify(dict(job))
+
+
+@bp.route("/export/<table>")
+def export(table):
+    if table not in EXPORT_FIELDS:
+        return error_response(
+            f"Invalid table, exportable tables are: {', '.join(EXPORT_FIELDS)}.", 404
+        )
+    format = request.args.get("format", "csv")
+    if format not in EXPORT_FORMATS:
+        return error_response(
+            f"Invalid format, formats are: {', '.join(EXPORT_FORMATS)}.", 400
+        )
+    fields = get_fields(EXPORT_FIELDS[table])
+    if fields is None:
+        return error_response(
+            f"Invalid fields, allowed fields are: {', '.join(EXPORT_FIELDS[table])}.", 400
+        )
+    since = request.args.get("since", type=int)
+    until = request.args.get("until", type=int)
+    if (since is not None or until is not None) and not db.EXPORT_TABLES[table][1]:
+        return error_response(f"The {table} table has no timestamps.", 400)
+
+    error, rows = db.iter_export(
+        table, fields, request.args.getlist("product_id"), since, until
+    )
+    if error or rows is None:
+        return error_response(error or "Error retrieving data.", 500)
+
+    compress = request.args.get("compress") == "gzip"
+    filename = f"{table}.{format}" + (".gz" if compress else "")
+    db.defer_close_db()
+    return Response(
+        stream_with_context(generate_export(rows, fields, format, compress)),
+        mimetype="application/gzip" if compress else EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -2,6 +2,7 @@ import functools
 
 from flask import (
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
@@ -12,7 +13,8 @@ from flask import (
 )
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from booth import db
+from booth import db, read_int_config
+from booth.cache import LRUCache
 
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
@@ -64,6 +66,7 @@ def login():
         if not error and user:
             session.clear()
             session["user_id"] = user["id"]
+            invalidate_user(user["id"])
             return redirect(url_for("index"))
 
     if error:
@@ -74,16 +77,28 @@ def login():
     )
 
 
+def invalidate_user(user_id):
+    """
+    Drops the user from the cache, to be called whenever the user changes.
+    """
+    current_app.extensions["user_cache"].delete(user_id)
+
+
 @bp.before_app_request
 def load_logged_in_user():
     user_id = session.get("user_id")
 
-    if user_id is None:
+    # Static files never render the user
+    if user_id is None or request.endpoint == "static":
         g.user = None
     else:
-        error, user = db.get_user(id=user_id)
-        if not error and user:
-            g.user = user
+        users = current_app.extensions["user_cache"]
+        user = users.get(user_id)
+        if user is None:
+            error, user = db.get_user(id=user_id)
+            if not error and user:
+                users.set(user_id, user)
+        g.user = user
 
 
 @bp.route("/logout")
@@ -101,3 +116,10 @@ def login_required(view):
         return view(**kwargs)
 
     return wrapped_view
+
+
+def init_app(app):
+    app.extensions["user_cache"] = LRUCache(
+        max_size=read_int_config(app, "USER_CACHE_SIZE", 1024),
+        ttl=read_int_config(app, "USER_CACHE_TTL_SECONDS", 60),
+    )
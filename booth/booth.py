@@ -1,30 +1,62 @@
 from flask import (
     Blueprint,
+    current_app,
     flash,
     redirect,
     render_template,
     request,
     url_for,
 )
+import base64
 from datetime import datetime
 import json
+import time
 
-from booth import auth, db, offers as booth_offers
+from booth import auth, cache, db, read_int_config
 
 
 bp = Blueprint("booth", __name__)
 
 
+def encode_cursor(product):
+    return base64.urlsafe_b64encode(
+        json.dumps([product["name"], product["id"]]).encode("utf-8")
+    ).decode("ascii")
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        name, id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return str(name), str(id)
+    except Exception:
+        return None
+
+
 @bp.route("/")
+@cache.cached_view(lambda: ["catalogue"])
 def index():
-    error, products = db.get_all_products()
+    after = decode_cursor(request.args.get("after"))
+    before = decode_cursor(request.args.get("before"))
+    limit = max(read_int_config(current_app, "PRODUCTS_PAGE_SIZE", 50), 1)
+    error, page = db.get_products_page(after=after, before=before, limit=limit)
 
     if error:
         flash(error)
 
+    products = page["products"] if page else []
+    prev_url, next_url = None, None
+    if products and page["has_prev"]:
+        prev_url = url_for("booth.index", before=encode_cursor(products[0]))
+    if products and page["has_next"]:
+        next_url = url_for("booth.index", after=encode_cursor(products[-1]))
+
     return render_template(
         "booth/index.html",
-        products=products or [],
+        products=products,
+        prev_url=prev_url,
+        next_url=next_url,
         is_index=True,
     )
 
@@ -35,7 +67,6 @@ def register():
     error: str | None = None
 
     if request.method == "POST":
-        product_id = None
         name = request.form["name"]
         description = request.form["description"]
 
@@ -47,25 +78,9 @@ def register():
         if not error:
             error, product_id = db.register_product(name, description)
 
-        if product_id and not error:
-            error = booth_offers.register_product(product_id, name, description)
-
-        if error and product_id:
-            db.delete_product(product_id)
-
         if not error:
-            if product_id:
-                error, product_offers = booth_offers.get_offers(product_id)
-                if not error and product_offers:
-                    for offer in product_offers:
-                        db.add_offer(
-                            offer["id"],
-                            product_id,
-                            offer["price"],
-                            offer["items_in_stock"],
-                        )
-            flash(f"Product correctly registered!")
-            return redirect(url_for("booth.index"))
+            # The registration to the offers API is processed in background
+            return redirect(url_for("booth.registration", product_id=product_id))
 
     if error:
         flash(error)
@@ -73,6 +88,25 @@ def register():
     return render_template("booth/register.html", back_url=url_for("booth.index"))
 
 
+@bp.route("/<product_id>/registration")
+@auth.login_required
+def registration(product_id):
+    error, job = db.get_registration_job(product_id)
+
+    if error:
+        flash(error)
+        return redirect(url_for("booth.index"))
+
+    _, product = db.get_product(product_id)
+
+    return render_template(
+        "booth/registration.html",
+        back_url=url_for("booth.index"),
+        product=product,
+        job=job,
+    )
+
+
 @bp.route("/<product_id>/edit", methods=("GET", "POST"))
 @auth.login_required
 def edit(product_id):
@@ -132,6 +166,7 @@ def delete(product_id):
 
 
 @bp.route("/<product_id>/offers")
+@cache.cached_view(lambda product_id: [f"offers:{product_id}"])
 def offers(product_id):
     error, product = db.get_product(product_id)
 
@@ -152,13 +187,24 @@ def offers(product_id):
     )
 
 
+HISTORY_SPANS = {"day": 1, "week": 7, "month": 30, "year": 365}
+
+
 @bp.route("/<product_id>/history")
+@cache.cached_view(lambda product_id: ["history", f"history:{product_id}"])
 def history(product_id):
     error, product = db.get_product(product_id)
 
+    span = request.args.get("span")
+    since, limit = None, None
+    if span in HISTORY_SPANS:
+        since = int(time.time()) - HISTORY_SPANS[span] * 86400
+    else:
+        limit = max(read_int_config(current_app, "HISTORY_LATEST_RECORDS", 100), 1)
+
     price_history = None
     if not error:
-        error, price_history = db.get_price_history(product_id)
+        error, price_history = db.get_price_history(product_id, since=since, limit=limit)
 
     if error:
         flash(error)
@@ -185,6 +231,7 @@ def history(product_id):
         "booth/history.html",
         back_url=url_for("booth.offers", product_id=product_id),
         product=product,
+        spans=HISTORY_SPANS.keys(),
         labels=json.dumps(labels),
         datasets=json.dumps(datasets)
     )
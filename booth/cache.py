@@ -0,0 +1,169 @@
+from collections import OrderedDict
+import functools
+import hashlib
+import threading
+import time
+
+from flask import current_app, g, get_flashed_messages, request, session
+
+from booth import db, read_int_config
+
+
+class LRUCache:
+    """
+    Thread safe mapping keeping at most max_size entries, evicting the least
+    recently used ones first.
+
+    :param max_size: maximum number of entries
+    :param ttl: seconds after which an entry expires, never if None
+    """
+
+    def __init__(self, max_size=256, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+_MISSING = object()
+
+
+class SingleFlight:
+    """
+    Runs a function once for the concurrent callers passing the same key,
+    sharing its result, or its exception, with all of them. The results
+    accepted by memoize are also returned to the next callers for ttl seconds.
+
+    :param ttl: seconds results are memoized, never if 0
+    :param max_size: maximum number of memoized results
+    """
+
+    def __init__(self, ttl=0, max_size=1024):
+        self._memo = LRUCache(max_size, ttl) if ttl > 0 else None
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, memoize=lambda result: True):
+        if self._memo is not None:
+            result = self._memo.get(key, _MISSING)
+            if result is not _MISSING:
+                return result
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+        try:
+            call.result = func()
+            if self._memo is not None and memoize(call.result):
+                self._memo.set(key, call.result)
+            return call.result
+        except Exception as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def cached_view(get_scopes):
+    """
+    Serves the view with an ETag and a Last-Modified header derived from the
+    cache versions of its scopes, answering 304 Not Modified to matching
+    conditional requests and reusing the rendered body until a write bumps
+    one of the versions.
+
+    :param get_scopes: function receiving the view arguments and returning
+        the cache version scopes the view reads
+    """
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped_view(**kwargs):
+            # Pending flash messages are rendered once, they cannot be cached
+            if session.get("_flashes"):
+                return view(**kwargs)
+
+            error, versions = db.get_cache_versions(get_scopes(**kwargs))
+            if error:
+                return view(**kwargs)
+
+            user_id = g.user["id"] if g.get("user") else None
+            etag = hashlib.sha1(
+                f"{request.full_path}|{user_id}|{versions}".encode("utf-8")
+            ).hexdigest()
+            updated_at = [updated_at for _, updated_at in versions if updated_at]
+            last_modified = max(updated_at) if updated_at else None
+
+            responses = current_app.extensions["response_cache"]
+            body = responses.get(etag)
+            if body is None and request.if_none_match.contains(etag):
+                response = current_app.response_class()
+            elif body is None:
+                response = current_app.make_response(view(**kwargs))
+                if response.status_code != 200 or get_flashed_messages():
+                    return response
+                responses.set(etag, response.get_data())
+            else:
+                response = current_app.response_class(body, mimetype="text/html")
+
+            response.set_etag(etag)
+            if last_modified:
+                response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+
+        return wrapped_view
+
+    return decorator
+
+
+def init_app(app):
+    app.extensions["response_cache"] = LRUCache(
+        max_size=read_int_config(app, "RESPONSE_CACHE_SIZE", 256)
+    )
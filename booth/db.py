@@ -1,54 +1,288 @@
+from contextlib import contextmanager
+import functools
+import itertools
 from enum import Enum
+import os
+import re
 import sqlite3
+import threading
+import time
 from uuid import uuid4
+import weakref
 
 import click
 from flask import current_app, g
 
-from booth import constants
+from booth import constants, metrics, read_int_config
+
+
+# Pragmas applied to every new connection, read from the app config
+PRAGMAS = {
+    "journal_mode": "SQLITE_JOURNAL_MODE",
+    "synchronous": "SQLITE_SYNCHRONOUS",
+    "mmap_size": "SQLITE_MMAP_SIZE",
+    "cache_size": "SQLITE_CACHE_SIZE",
+    "busy_timeout": "SQLITE_BUSY_TIMEOUT_MS",
+}
+
+
+class _PooledConnection:
+    """
+    Owner of the connection of a thread, finalized with the thread.
+    """
+
+    __slots__ = ("db", "__weakref__")
+
+    def __init__(self, db):
+        self.db = db
+
+
+class ConnectionPool:
+    """
+    Keeps one connection per thread open across app contexts, so that
+    requests and jobs running on the same thread reuse it. The connection of
+    a thread is closed when the thread exits.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._keys = itertools.count()
+
+    def get(self, connect):
+        owner = getattr(self._local, "owner", None)
+        if owner is None:
+            owner = _PooledConnection(connect())
+            key = next(self._keys)
+            with self._lock:
+                self._connections[key] = owner.db
+            # Runs when the thread-local storage of the thread is cleared
+            weakref.finalize(owner, self._release, key)
+            self._local.owner = owner
+        return owner.db
+
+    def _release(self, key):
+        with self._lock:
+            db = self._connections.pop(key, None)
+        if db is not None:
+            db.close()
+
+    def size(self):
+        """
+        :return: the number of open connections
+        """
+        with self._lock:
+            return len(self._connections)
+
+    def close(self):
+        with self._lock:
+            for db in self._connections.values():
+                db.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+def _connect():
+    db = sqlite3.connect(
+        current_app.config["DATABASE"],
+        detect_types=sqlite3.PARSE_DECLTYPES,
+        check_same_thread=False,
+    )
+    db.row_factory = sqlite3.Row
+    for pragma, name in PRAGMAS.items():
+        value = str(current_app.config.get(name, ""))
+        if not value:
+            continue
+        if not re.fullmatch(r"-?\w+", value):
+            current_app.logger.error(f"Invalid {name}: {value}, ignored")
+            continue
+        db.execute(f"PRAGMA {pragma} = {value}")
+    return db
+
+
+def _is_pooled():
+    return str(current_app.config["DATABASE_POOL"]).lower() in ("1", "true", "yes")
 
 
 def get_db():
     if "db" not in g:
-        g.db = sqlite3.connect(
-            current_app.config["DATABASE"],
-            detect_types=sqlite3.PARSE_DECLTYPES,
-        )
-        g.db.row_factory = sqlite3.Row
+        if _is_pooled():
+            g.db = current_app.extensions["db_pool"].get(_connect)
+        else:
+            g.db = _connect()
 
     return g.db
 
 
 def close_db(e=None):
+    if g.pop("db_close_deferred", False):
+        return
+
     db = g.pop("db", None)
 
-    if db is not None:
+    if db is None:
+        return
+    if _is_pooled():
+        # Never hand over an open transaction to the next user of the connection
+        if db.in_transaction:
+            db.rollback()
+    else:
         db.close()
 
 
-def init_db():
+def close_pool():
+    """
+    Closes every pooled connection of the app, e.g. on shutdown.
+    """
+    g.pop("db", None)
+    current_app.extensions["db_pool"].close()
+
+
+def defer_close_db():
+    """
+    Keeps the connection open past the first teardown of the app context,
+    for responses reading from a cursor after the view returned: the app
+    context is torn down again once stream_with_context has consumed them.
+    """
+    g.db_close_deferred = True
+
+
+def _list_migrations():
+    """
+    Lists the migration scripts of the migrations folder, named
+    <version>_<name>.sql, sorted by version.
+    """
+    migrations = []
+    for filename in os.listdir(os.path.join(current_app.root_path, "migrations")):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if match:
+            migrations.append((int(match[1]), match[2], filename))
+    return sorted(migrations)
+
+
+def get_schema_version():
     db = get_db()
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        " version INTEGER PRIMARY KEY,"
+        " name TEXT NOT NULL,"
+        " applied_at INTEGER NOT NULL)"
+    )
+    db.commit()
+    return db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
 
-    with current_app.open_resource("schema.sql") as f:
-        script = f.read().decode("utf-8")
-        print("sql script", script)
-        db.executescript(script)
+def init_db():
+    """
+    Applies the migrations newer than the current schema version, each one
+    in its own transaction. Existing data is preserved. Processes
+    initializing the same db concurrently apply each migration once: its
+    version is recorded first, so that the others fail on it and skip it.
+
+    :return: the applied migrations
+    """
+    db = get_db()
+    current_version = get_schema_version()
+    applied = []
+
+    for version, name, filename in _list_migrations():
+        if version <= current_version:
+            continue
+        with current_app.open_resource(f"migrations/{filename}") as f:
+            script = f.read().decode("utf-8")
+        try:
+            db.executescript(
+                "BEGIN IMMEDIATE;\n"
+                f"INSERT INTO schema_version (version, name, applied_at)"
+                f" VALUES ({version}, '{name}', {int(time.time())});\n"
+                f"{script}\nCOMMIT;"
+            )
+        except Exception as e:
+            if db.in_transaction:
+                db.rollback()
+            if isinstance(e, sqlite3.IntegrityError) and get_schema_version() >= version:
+                continue
+            raise
+        current_app.logger.info(f"DB: applied migration {filename}")
+        applied.append(filename)
+
+    return applied
 
 
 @click.command("init-db")
 def init_db_command():
-    init_db()
+    applied = init_db()
+    for filename in applied or []:
+        click.echo(f"Applied migration {filename}.")
     click.echo("Initialized the database.")
 
 
 def init_app(app):
+    app.extensions["db_pool"] = ConnectionPool()
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
 
 
+# Transactions
+
+
+@contextmanager
+def transaction():
+    """
+    Groups every write issued inside the block in a single transaction,
+    committed when the outermost block exits and rolled back on exceptions.
+    Blocks can be nested: only the outermost one commits.
+    """
+    db = get_db()
+    depth = g.get("db_transaction_depth", 0)
+    g.db_transaction_depth = depth + 1
+    try:
+        yield db
+    except Exception:
+        if depth == 0:
+            db.rollback()
+        raise
+    else:
+        if depth == 0:
+            db.commit()
+    finally:
+        g.db_transaction_depth = depth
+
+
+def _commit(db):
+    if not g.get("db_transaction_depth", 0):
+        db.commit()
+
+
 # SQL helpers
 
 
+def _timed(operation, table):
+    """
+    Observes the duration of the queries run inside the block.
+    """
+    return metrics.DB_QUERY_SECONDS.time(operation=operation, table=table)
+
+
+def _instrumented(operation):
+    """
+    Observes the duration of each call of the decorated helper by table.
+    """
+
+    def decorator(helper):
+        @functools.wraps(helper)
+        def wrapped(table, *args, **kwargs):
+            with _timed(operation, table):
+                return helper(table, *args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+
+@_instrumented("create")
 def _create(table, params: dict):
     keys = params.keys()
     values = params.values()
@@ -57,10 +291,25 @@ def _create(table, params: dict):
         f"INSERT INTO {table} ({', '.join(keys)}) VALUES ({', '.join(['?' for _ in keys])})",
         tuple(values),
     )
-    db.commit()
+    _commit(db)
     current_app.logger.info(f"DB: table {table}, create row {params}")
 
 
+@_instrumented("create_bulk")
+def _create_bulk(table, rows: list[dict]):
+    if not rows:
+        return
+    keys = rows[0].keys()
+    db = get_db()
+    db.executemany(
+        f"INSERT INTO {table} ({', '.join(keys)}) VALUES ({', '.join(['?' for _ in keys])})",
+        [tuple(row[key] for key in keys) for row in rows],
+    )
+    _commit(db)
+    current_app.logger.info(f"DB: table {table}, create {len(rows)} rows in bulk")
+
+
+@_instrumented("read")
 def _read(table, project: list, query: dict):
     keys = query.keys()
     values = query.values()
@@ -76,6 +325,7 @@ def _read(table, project: list, query: dict):
     return row
 
 
+@_instrumented("read_all")
 def _read_all(table, project: list, order_by=None):
     rows = (
         get_db()
@@ -92,6 +342,7 @@ def _read_all(table, project: list, order_by=None):
     return rows
 
 
+@_instrumented("read_bulk")
 def _read_bulk(table, project: list, query: dict, order_by=None):
     keys = query.keys()
     values = query.values()
@@ -111,6 +362,28 @@ def _read_bulk(table, project: list, query: dict, order_by=None):
     return rows
 
 
+@_instrumented("read_iter")
+def _read_iter(table, project: list, query: dict | None = None, order_by=None):
+    """
+    Returns a cursor yielding the rows lazily, so that large results are
+    never held in memory at once.
+    """
+    keys = (query or {}).keys()
+    values = (query or {}).values()
+    cursor = get_db().execute(
+        f"SELECT {', '.join(project)} FROM {table}"
+        + (f" WHERE {' AND '.join([f'({key} = ?)' for key in keys])}" if keys else "")
+        + (f" ORDER BY {order_by}" if order_by else ""),
+        tuple(values),
+    )
+    current_app.logger.info(
+        f"DB: table {table}, iterate rows where {query}"
+        + (f", order by {order_by}" if order_by else "")
+    )
+    return cursor
+
+
+@_instrumented("update")
 def _update(table, query: dict, updates: dict):
     query_keys = query.keys()
     query_values = list(query.values())
@@ -121,12 +394,13 @@ def _update(table, query: dict, updates: dict):
         f"UPDATE {table} SET {', '.join([f'{key} = ?' for key in update_keys])} WHERE {' AND '.join([f'({key} = ?)' for key in query_keys])}",
         tuple(update_values + query_values),
     )
-    db.commit()
+    _commit(db)
     current_app.logger.info(
         f"DB: table {table}, update row {query} with values {updates}"
     )
 
 
+@_instrumented("delete")
 def _delete(table, query: dict):
     keys = query.keys()
     values = query.values()
@@ -135,10 +409,160 @@ def _delete(table, query: dict):
         f"DELETE FROM {table} WHERE {' AND '.join([f'({key} = ?)' for key in keys])}",
         tuple(values),
     )
-    db.commit()
+    _commit(db)
     current_app.logger.info(f"DB: table {table}, delete row where {query}")
 
 
+@_instrumented("delete_bulk")
+def _delete_bulk(table, key, values: list, chunk_size=500):
+    if not values:
+        return
+    db = get_db()
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i : i + chunk_size]
+        db.execute(
+            f"DELETE FROM {table} WHERE {key} IN ({', '.join(['?' for _ in chunk])})",
+            tuple(chunk),
+        )
+    _commit(db)
+    current_app.logger.info(
+        f"DB: table {table}, delete {len(values)} rows in bulk by {key}"
+    )
+
+
+@_instrumented("upsert_bulk")
+def _upsert_bulk(table, conflict_keys: list, rows: list[dict]):
+    """
+    Inserts the rows, updating the existing ones conflicting on conflict_keys.
+    """
+    if not rows:
+        return
+    keys = rows[0].keys()
+    update_keys = [key for key in keys if key not in conflict_keys]
+    db = get_db()
+    db.executemany(
+        f"INSERT INTO {table} ({', '.join(keys)}) VALUES ({', '.join(['?' for _ in keys])})"
+        f" ON CONFLICT ({', '.join(conflict_keys)}) DO UPDATE SET {', '.join([f'{key} = excluded.{key}' for key in update_keys])}",
+        [tuple(row[key] for key in keys) for row in rows],
+    )
+    _commit(db)
+    current_app.logger.info(f"DB: table {table}, upsert {len(rows)} rows in bulk")
+
+
+# Cache versions
+
+
+def _touch(scopes: list):
+    """
+    Bumps the cache version of the scopes, invalidating the cached views
+    reading them.
+    """
+    db = get_db()
+    now = int(time.time())
+    with _timed("touch", "cache_versions"):
+        db.executemany(
+            "INSERT INTO cache_versions (scope, version, updated_at) VALUES (?, 1, ?)"
+            " ON CONFLICT (scope) DO UPDATE SET"
+            " version = version + 1, updated_at = excluded.updated_at",
+            [(scope, now) for scope in scopes],
+        )
+
+
+def _touch_products(prefix, select, params=()):
+    """
+    Bumps the cache version of the scopes prefix + product_id of every
+    product_id returned by the select query.
+    """
+    db = get_db()
+    now = int(time.time())
+    with _timed("touch", "cache_versions"):
+        db.execute(
+            "INSERT INTO cache_versions (scope, version, updated_at)"
+            f" SELECT DISTINCT ? || product_id, 1, ? FROM ({select}) WHERE true"
+            " ON CONFLICT (scope) DO UPDATE SET"
+            " version = version + 1, updated_at = excluded.updated_at",
+            (prefix, now, *params),
+        )
+
+
+def get_cache_versions(scopes: list):
+    """
+    :return: the version and the last update timestamp of each scope,
+        (0, None) for scopes never written
+    """
+    error, versions = None, None
+
+    try:
+        with _timed("read_bulk", "cache_versions"):
+            rows = {
+                row["scope"]: (row["version"], row["updated_at"])
+                for row in get_db().execute(
+                    "SELECT scope, version, updated_at FROM cache_versions"
+                    f" WHERE scope IN ({', '.join(['?' for _ in scopes])})",
+                    tuple(scopes),
+                )
+            }
+        versions = [rows.get(scope, (0, None)) for scope in scopes]
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, versions
+
+
+# Scheduler leases
+
+
+def acquire_lease(job, owner, ttl_seconds):
+    """
+    Takes or renews the lease of a scheduler job for ttl_seconds, unless
+    another owner holds a lease that did not expire yet. The check and the
+    write are a single statement, hence atomic across processes.
+
+    :return: whether owner holds the lease
+    """
+    error, acquired = None, None
+
+    try:
+        db = get_db()
+        now = time.time()
+        with _timed("acquire_lease", "scheduler_leases"):
+            cursor = db.execute(
+                "INSERT INTO scheduler_leases (job, owner, expires_at) VALUES (?, ?, ?)"
+                " ON CONFLICT (job) DO UPDATE SET"
+                " owner = excluded.owner, expires_at = excluded.expires_at"
+                " WHERE owner = excluded.owner OR expires_at < ?",
+                (job, owner, now + ttl_seconds, now),
+            )
+            acquired = cursor.rowcount == 1
+            _commit(db)
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, acquired
+
+
+def release_lease(job, owner):
+    """
+    Lets another process take the lease of a scheduler job right away.
+    """
+    error = None
+
+    try:
+        db = get_db()
+        with _timed("delete", "scheduler_leases"):
+            db.execute(
+                "DELETE FROM scheduler_leases WHERE job = ? AND owner = ?", (job, owner)
+            )
+            _commit(db)
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
 # Model
 
 
@@ -178,13 +602,20 @@ def add_user(username, password):
 
 
 def register_product(name, description):
+    """
+    Adds the product and queues its registration to the offers API.
+    """
     error = None
     product_id = str(uuid4())
 
     try:
-        _create(
-            "products", {"id": product_id, "name": name, "description": description}
-        )
+        with transaction():
+            _create(
+                "products",
+                {"id": product_id, "name": name, "description": description},
+            )
+            _create_registration_job(product_id)
+            _touch(["catalogue"])
     except sqlite3.IntegrityError as e:
         current_app.logger.error(e)
         error = f'Name "{name}" is already used by another product.'
@@ -198,6 +629,49 @@ def register_product(name, description):
     return error, product_id
 
 
+def register_products(products: list[dict]):
+    """
+    Adds the products whose name is not used yet and queues their
+    registration to the offers API, in a single transaction.
+
+    :param products: dicts with keys name and description
+    :return: the number of added products
+    """
+    error, count = None, None
+
+    try:
+        now = int(time.time())
+        added_ids = []
+        with transaction(), _timed("create_bulk", "products"):
+            db = get_db()
+            for product in products:
+                product_id = str(uuid4())
+                cursor = db.execute(
+                    "INSERT INTO products (id, name, description) VALUES (?, ?, ?)"
+                    " ON CONFLICT (name) DO NOTHING",
+                    (product_id, product["name"], product["description"]),
+                )
+                if cursor.rowcount:
+                    added_ids.append(product_id)
+            db.executemany(
+                "INSERT INTO registration_jobs"
+                " (product_id, status, next_attempt_at, created_at, updated_at)"
+                " VALUES (?, 'pending', ?, ?, ?)",
+                [(product_id, now, now, now) for product_id in added_ids],
+            )
+            if added_ids:
+                _touch(["catalogue"])
+        count = len(added_ids)
+        current_app.logger.info(
+            f"DB: table products, create {count} of {len(products)} rows in bulk"
+        )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, count
+
+
 def get_all_products():
     error, products = None, None
 
@@ -213,6 +687,166 @@ def get_all_products():
     return error, products
 
 
+def iter_products(project=("id", "name", "description")):
+    error, products = None, None
+
+    try:
+        products = _read_iter("products", list(project), order_by="name")
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, products
+
+
+def get_products_page(after=None, before=None, limit=50):
+    """
+    Reads a page of products ordered by name and id, seeking from a cursor
+    so that the cost of a page does not depend on its position.
+
+    :param after: (name, id) of the product preceding the page
+    :param before: (name, id) of the product following the page
+    :return: the products of the page and whether there are previous and
+        next pages
+    """
+    error, page = None, None
+
+    try:
+        with _timed("read_page", "products"):
+            project = "SELECT id, name, description FROM products"
+            if before is not None:
+                rows = (
+                    get_db()
+                    .execute(
+                        f"{project} WHERE (name, id) < (?, ?) ORDER BY name DESC, id DESC LIMIT ?",
+                        (*before, limit + 1),
+                    )
+                    .fetchall()
+                )
+                page = {
+                    "products": rows[:limit][::-1],
+                    "has_prev": len(rows) > limit,
+                    "has_next": True,
+                }
+            else:
+                rows = (
+                    get_db()
+                    .execute(
+                        f"{project}"
+                        + (" WHERE (name, id) > (?, ?)" if after is not None else "")
+                        + " ORDER BY name, id LIMIT ?",
+                        (*(after or ()), limit + 1),
+                    )
+                    .fetchall()
+                )
+                page = {
+                    "products": rows[:limit],
+                    "has_prev": after is not None,
+                    "has_next": len(rows) > limit,
+                }
+        current_app.logger.info(
+            f"DB: table products, read page after {after} before {before} limit {limit}"
+        )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, page
+
+
+def count_products():
+    error, count = None, None
+
+    try:
+        with _timed("count", "products"):
+            count = get_db().execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        current_app.logger.info("DB: table products, count rows")
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, count
+
+
+# Products whose offers can be synced: registered to the offers API, or
+# added before the registrations were queued
+SYNCABLE_PRODUCTS = (
+    "FROM products p LEFT JOIN registration_jobs j ON j.product_id = p.id"
+    " WHERE j.status IS NULL OR j.status = 'done'"
+)
+
+
+def count_syncable_products():
+    error, count = None, None
+
+    try:
+        with _timed("count", "products"):
+            count = get_db().execute(f"SELECT COUNT(*) {SYNCABLE_PRODUCTS}").fetchone()[0]
+        current_app.logger.info("DB: table products, count syncable rows")
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, count
+
+
+def get_stalest_products(limit):
+    """
+    :return: the limit syncable products whose sync was attempted the
+        longest time ago, never attempted first
+    """
+    error, products = None, None
+
+    try:
+        with _timed("read_bulk", "products"):
+            products = (
+                get_db()
+                .execute(
+                    f"SELECT p.id, p.name, p.description {SYNCABLE_PRODUCTS}"
+                    " ORDER BY p.last_attempted_at, p.id LIMIT ?",
+                    (limit,),
+                )
+                .fetchall()
+            )
+        current_app.logger.info(f"DB: table products, read {limit} stalest rows")
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, products
+
+
+def mark_products_synced(ids: list, timestamp, failed_ids=()):
+    """
+    Records the sync attempt of the synced and the failed products, and the
+    sync of the synced ones.
+    """
+    error = None
+
+    try:
+        db = get_db()
+        with _timed("update_bulk", "products"):
+            db.executemany(
+                "UPDATE products SET last_synced_at = ?, last_attempted_at = ?"
+                " WHERE id = ?",
+                [(timestamp, timestamp, id) for id in ids],
+            )
+            db.executemany(
+                "UPDATE products SET last_attempted_at = ? WHERE id = ?",
+                [(timestamp, id) for id in failed_ids],
+            )
+            _commit(db)
+        current_app.logger.info(
+            f"DB: table products, mark {len(ids)} rows synced"
+            f" and {len(failed_ids)} failed at {timestamp}"
+        )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
 def get_product(id):
     error, product = None, None
 
@@ -232,7 +866,11 @@ def update_product(id, name, description):
     error = None
 
     try:
-        _update("products", {"id": id}, {"name": name, "description": description})
+        with transaction():
+            _update(
+                "products", {"id": id}, {"name": name, "description": description}
+            )
+            _touch(["catalogue", f"offers:{id}", f"history:{id}"])
     except sqlite3.IntegrityError as e:
         current_app.logger.error(e)
         error = f'Name "{name}" is already used by another product.'
@@ -247,7 +885,111 @@ def delete_product(id):
     error = None
 
     try:
-        _delete("products", {"id": id})
+        with transaction():
+            _delete("products", {"id": id})
+            _touch(["catalogue", f"offers:{id}", f"history:{id}"])
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
+def _create_registration_job(product_id):
+    now = int(time.time())
+    _create(
+        "registration_jobs",
+        {
+            "product_id": product_id,
+            "status": "pending",
+            "next_attempt_at": now,
+            "created_at": now,
+            "updated_at": now,
+        },
+    )
+
+
+def get_registration_job(product_id):
+    error, job = None, None
+
+    try:
+        job = _read(
+            "registration_jobs",
+            ["product_id", "status", "attempts", "error", "created_at", "updated_at"],
+            {"product_id": product_id},
+        )
+
+        if job is None:
+            error = f"No registration for product id {product_id}"
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, job
+
+
+def claim_registration_jobs(limit, claim_timeout_seconds):
+    """
+    Marks as running the limit registrations due the longest time ago. They
+    are due again after claim_timeout_seconds, so that a registration left
+    running by a dead worker is attempted again: the timeout must exceed the
+    longest attempt. A registration claimed meanwhile by another process is
+    left to it.
+
+    :return: the claimed registrations with the name and description of
+        their product, None if the product was deleted, and the number of
+        previous attempts
+    """
+    error, jobs = None, None
+
+    try:
+        now = int(time.time())
+        db = get_db()
+        with _timed("claim", "registration_jobs"):
+            candidates = db.execute(
+                "SELECT j.product_id, j.attempts, p.name, p.description"
+                " FROM registration_jobs j LEFT JOIN products p ON p.id = j.product_id"
+                " WHERE j.status IN ('pending', 'running') AND j.next_attempt_at <= ?"
+                " ORDER BY j.next_attempt_at LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            jobs = []
+            with transaction():
+                for job in candidates:
+                    cursor = db.execute(
+                        "UPDATE registration_jobs SET status = 'running',"
+                        " attempts = attempts + 1, next_attempt_at = ?, updated_at = ?"
+                        " WHERE product_id = ? AND attempts = ?",
+                        (
+                            now + claim_timeout_seconds,
+                            now,
+                            job["product_id"],
+                            job["attempts"],
+                        ),
+                    )
+                    if cursor.rowcount:
+                        jobs.append(job)
+        current_app.logger.info(f"DB: table registration_jobs, claim {len(jobs)} rows")
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, jobs
+
+
+def finish_registration_job(product_id, status, job_error=None, next_attempt_at=None):
+    """
+    :param status: "done", "failed", or "pending" to attempt it again
+    :param job_error: error of the last attempt
+    :param next_attempt_at: timestamp of the next attempt of a pending registration
+    """
+    error = None
+
+    try:
+        updates = {"status": status, "error": job_error, "updated_at": int(time.time())}
+        if next_attempt_at is not None:
+            updates["next_attempt_at"] = next_attempt_at
+        _update("registration_jobs", {"product_id": product_id}, updates)
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
@@ -274,19 +1016,37 @@ def get_product_offers(product_id):
     return error, product_offers
 
 
+def iter_product_offers(
+    product_id, project=("id", "product_id", "price", "items_in_stock")
+):
+    error, product_offers = None, None
+
+    try:
+        product_offers = _read_iter(
+            "offers", list(project), {"product_id": product_id}, order_by="id"
+        )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, product_offers
+
+
 def add_offer(id, product_id, price, items_in_stock):
     error = None
 
     try:
-        _create(
-            "offers",
-            {
-                "id": id,
-                "product_id": product_id,
-                "price": price,
-                "items_in_stock": items_in_stock,
-            },
-        )
+        with transaction():
+            _create(
+                "offers",
+                {
+                    "id": id,
+                    "product_id": product_id,
+                    "price": price,
+                    "items_in_stock": items_in_stock,
+                },
+            )
+            _touch([f"offers:{product_id}"])
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
@@ -297,19 +1057,80 @@ def add_offer(id, product_id, price, items_in_stock):
     return error
 
 
+def add_offers(offers: list[dict]):
+    """
+    :param offers: dicts with keys id, product_id, price and items_in_stock
+    """
+    error = None
+
+    try:
+        with transaction():
+            _create_bulk(
+                "offers",
+                [
+                    {
+                        "id": offer["id"],
+                        "product_id": offer["product_id"],
+                        "price": offer["price"],
+                        "items_in_stock": offer["items_in_stock"],
+                    }
+                    for offer in offers
+                ],
+            )
+            _touch(list({f"offers:{offer['product_id']}" for offer in offers}))
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
 def update_offer(id, product_id, price, items_in_stock):
     error = None
 
     try:
-        _update(
-            "offers",
-            {"id": id},
-            {
-                "product_id": product_id,
-                "price": price,
-                "items_in_stock": items_in_stock,
-            },
-        )
+        with transaction():
+            _update(
+                "offers",
+                {"id": id},
+                {
+                    "product_id": product_id,
+                    "price": price,
+                    "items_in_stock": items_in_stock,
+                },
+            )
+            _touch([f"offers:{product_id}"])
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
+def upsert_offers(offers: list[dict]):
+    """
+    Adds the new offers and updates the existing ones.
+
+    :param offers: dicts with keys id, product_id, price and items_in_stock
+    """
+    error = None
+
+    try:
+        with transaction():
+            _upsert_bulk(
+                "offers",
+                ["id"],
+                [
+                    {
+                        "id": offer["id"],
+                        "product_id": offer["product_id"],
+                        "price": offer["price"],
+                        "items_in_stock": offer["items_in_stock"],
+                    }
+                    for offer in offers
+                ],
+            )
+            _touch(list({f"offers:{offer['product_id']}" for offer in offers}))
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
@@ -321,7 +1142,32 @@ def delete_offer(id):
     error = None
 
     try:
-        _delete("offers", {"id": id})
+        with transaction():
+            _touch_products(
+                "offers:", "SELECT product_id FROM offers WHERE id = ?", (id,)
+            )
+            _delete("offers", {"id": id})
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
+def delete_offers(ids: list):
+    error = None
+
+    try:
+        with transaction():
+            for i in range(0, len(ids), 500):
+                chunk = ids[i : i + 500]
+                _touch_products(
+                    "offers:",
+                    "SELECT product_id FROM offers"
+                    f" WHERE id IN ({', '.join(['?' for _ in chunk])})",
+                    tuple(chunk),
+                )
+            _delete_bulk("offers", "id", ids)
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
@@ -333,32 +1179,196 @@ def add_price_record(timestamp, product_id, mean_price, min_price):
     error = None
 
     try:
-        _create(
-            "price_history",
-            {
-                "timestamp": timestamp,
-                "product_id": product_id,
-                "mean_price": mean_price,
-                "min_price": min_price,
-            },
+        with transaction():
+            _create(
+                "price_history",
+                {
+                    "timestamp": timestamp,
+                    "product_id": product_id,
+                    "mean_price": mean_price,
+                    "min_price": min_price,
+                },
+            )
+            _touch([f"history:{product_id}"])
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
+def add_price_records(records: list[dict]):
+    """
+    :param records: dicts with keys timestamp, product_id, mean_price and min_price
+    """
+    error = None
+
+    try:
+        with transaction():
+            _create_bulk(
+                "price_history",
+                [
+                    {
+                        "timestamp": record["timestamp"],
+                        "product_id": record["product_id"],
+                        "mean_price": record["mean_price"],
+                        "min_price": record["min_price"],
+                    }
+                    for record in records
+                ],
+            )
+            _touch(
+                list({f"history:{record['product_id']}" for record in records})
+            )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error
+
+
+def add_price_records_from_offers(timestamp):
+    """
+    Appends a price record for every product with offers in stock, computing
+    the stock-weighted mean price and the minimum price in a single query.
+
+    :return: the number of added records
+    """
+    error, count = None, None
+
+    try:
+        db = get_db()
+        with _timed("create_from_offers", "price_history"):
+            cursor = db.execute(
+                "INSERT INTO price_history (timestamp, product_id, mean_price, min_price)"
+                " SELECT ?, product_id,"
+                " CAST(SUM(price * items_in_stock) AS REAL) / SUM(items_in_stock),"
+                " MIN(price)"
+                " FROM offers WHERE product_id IN (SELECT id FROM products)"
+                " GROUP BY product_id HAVING SUM(items_in_stock) > 0",
+                (timestamp,),
+            )
+        count = cursor.rowcount
+        _touch_products(
+            "history:",
+            "SELECT product_id FROM price_history WHERE timestamp = ?",
+            (timestamp,),
+        )
+        _commit(db)
+        current_app.logger.info(
+            f"DB: table price_history, create {count} rows from offers"
         )
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
 
+    return error, count
+
+
+# Rollup tiers of the price history, from the finest to the coarsest
+PRICE_HISTORY_TIERS = (
+    ("price_history_hourly", 3600),
+    ("price_history_daily", 86400),
+)
+
+
+def update_price_history_rollups(timestamp):
+    """
+    Folds the price records added at timestamp into the rollup tiers.
+    """
+    error = None
+
+    try:
+        db = get_db()
+        for table, bucket_seconds in PRICE_HISTORY_TIERS:
+            with _timed("rollup", table):
+                db.execute(
+                    f"INSERT INTO {table}"
+                    " (product_id, timestamp, mean_price, min_price, max_price, sample_count)"
+                    " SELECT product_id, timestamp - timestamp % ?,"
+                    " mean_price, min_price, mean_price, 1"
+                    " FROM price_history WHERE timestamp = ?"
+                    " ON CONFLICT (product_id, timestamp) DO UPDATE SET"
+                    " mean_price = (mean_price * sample_count + excluded.mean_price) / (sample_count + 1),"
+                    " min_price = MIN(min_price, excluded.min_price),"
+                    " max_price = MAX(max_price, excluded.max_price),"
+                    " sample_count = sample_count + 1",
+                    (bucket_seconds, timestamp),
+                )
+            current_app.logger.info(f"DB: table {table}, roll up records of {timestamp}")
+        _commit(db)
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
     return error
 
 
-def get_price_history(product_id):
+def _raw_price_history_span():
+    """
+    :return: the seconds covered by the raw price records, shortened by
+        MAX_PRODUCT_RECORDS when set to the span of that many ticks
+    """
+    span = read_int_config(current_app, "PRICE_HISTORY_RAW_RETENTION_SECONDS", 172800)
+    max_product_records = read_int_config(current_app, "MAX_PRODUCT_RECORDS", 0)
+    if max_product_records > 0:
+        span = min(
+            span,
+            max_product_records
+            * read_int_config(current_app, "UPDATE_PRICE_HISTORY_INTERVAL_SECONDS", 60),
+        )
+    return span
+
+
+def _price_history_table(since):
+    """
+    Selects the finest price history tier whose retention covers since.
+    """
+    if since is None:
+        return "price_history"
+    span = time.time() - since
+    if span <= _raw_price_history_span():
+        return "price_history"
+    if span <= read_int_config(current_app, "PRICE_HISTORY_HOURLY_RETENTION_SECONDS", 7776000):
+        return "price_history_hourly"
+    return "price_history_daily"
+
+
+def _read_price_history(product_id, since, project: list, limit=None):
+    table = _price_history_table(since)
+    select = (
+        f"SELECT {', '.join(project)} FROM {table}"
+        " WHERE (product_id = ?) AND (timestamp >= ?)"
+    )
+    params = (product_id, since or 0)
+    if limit is not None:
+        # The newest records, still returned from the oldest
+        select = f"SELECT * FROM ({select} ORDER BY timestamp DESC LIMIT ?)"
+        params += (limit,)
+    with _timed("read_iter", table):
+        cursor = get_db().execute(f"{select} ORDER BY timestamp", params)
+    current_app.logger.info(
+        f"DB: table {table}, read rows where product_id {product_id} since {since}"
+        f" limit {limit}"
+    )
+    return cursor
+
+
+def get_price_history(product_id, since=None, limit=None):
+    """
+    :param since: timestamp of the oldest record to return, used to select
+        the tier to read; the raw records are read if None
+    :param limit: maximum number of records to return, the newest ones
+    """
     error, price_history = None, None
 
     try:
-        price_history = _read_bulk(
-            "price_history",
+        price_history = _read_price_history(
+            product_id,
+            since,
             ["timestamp", "product_id", "mean_price", "min_price"],
-            {"product_id": product_id},
-            order_by="timestamp"
-        )
+            limit,
+        ).fetchall()
 
         if price_history is None:
             error = "Error retrieving product offers"
@@ -369,19 +1379,135 @@ def get_price_history(product_id):
     return error, price_history
 
 
-def delete_oldest_price_record(product_id):
-    error = None
+def iter_price_history(
+    product_id, since=None, project=("timestamp", "product_id", "mean_price", "min_price")
+):
+    error, price_history = None, None
+
+    try:
+        price_history = _read_price_history(product_id, since, list(project))
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, price_history
+
+
+def prune_price_history(max_product_records):
+    """
+    Keeps only the newest max_product_records raw records of each product.
+
+    :return: the number of deleted records
+    """
+    error, count = None, None
 
     try:
-        _delete(
-            "price_history",
-            {
-                "prodcut_id": product_id,
-                "timestamp": f"( SELECT MIN timestamp FROM price_history )",
-            },
+        db = get_db()
+        with _timed("delete_bulk", "price_history"):
+            cursor = db.execute(
+                "DELETE FROM price_history WHERE id IN ("
+                " SELECT id FROM ("
+                "  SELECT id, ROW_NUMBER() OVER ("
+                "   PARTITION BY product_id ORDER BY timestamp DESC, id DESC"
+                "  ) AS row_number FROM price_history"
+                " ) WHERE row_number > ?"
+                ")",
+                (max_product_records,),
+            )
+        count = cursor.rowcount
+        if count:
+            _touch(["history"])
+        _commit(db)
+        current_app.logger.info(
+            f"DB: table price_history, delete {count} rows exceeding {max_product_records} per product"
         )
     except Exception as e:
         current_app.logger.error(e)
         error = constants.GENERIC_ERROR_MESSAGE
 
-    return error
+    return error, count
+
+
+def prune_expired_price_history(raw_retention_seconds, hourly_retention_seconds):
+    """
+    Deletes the raw and hourly price records older than their retention.
+
+    :return: the number of deleted records
+    """
+    error, count = None, None
+
+    try:
+        db = get_db()
+        now = int(time.time())
+        count = 0
+        for table, retention_seconds in (
+            ("price_history", raw_retention_seconds),
+            ("price_history_hourly", hourly_retention_seconds),
+        ):
+            with _timed("delete_expired", table):
+                cursor = db.execute(
+                    f"DELETE FROM {table} WHERE timestamp < ?",
+                    (now - retention_seconds,),
+                )
+            count += cursor.rowcount
+            current_app.logger.info(
+                f"DB: table {table}, delete {cursor.rowcount} rows older than {retention_seconds}s"
+            )
+        if count:
+            _touch(["history"])
+        _commit(db)
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, count
+
+
+# Product id and timestamp columns of the exportable tables, None if missing
+EXPORT_TABLES = {
+    "products": ("id", None),
+    "offers": ("product_id", None),
+    "price_history": ("product_id", "timestamp"),
+}
+
+
+def iter_export(table, project: list, product_ids=None, since=None, until=None):
+    """
+    Reads a whole table in storage order from a cursor, without sorting or
+    loading it in memory.
+
+    :param product_ids: ids of the only products whose rows are read
+    :param since: timestamp of the oldest row read, for timestamped tables
+    :param until: timestamp the rows read are older than, for timestamped tables
+    """
+    error, rows = None, None
+
+    try:
+        product_column, time_column = EXPORT_TABLES[table]
+        conditions, params = [], []
+        if product_ids:
+            conditions.append(
+                f"{product_column} IN ({', '.join(['?' for _ in product_ids])})"
+            )
+            params.extend(product_ids)
+        if time_column and since is not None:
+            conditions.append(f"{time_column} >= ?")
+            params.append(since)
+        if time_column and until is not None:
+            conditions.append(f"{time_column} < ?")
+            params.append(until)
+        with _timed("read_iter", table):
+            rows = get_db().execute(
+                f"SELECT {', '.join(project)} FROM {table}"
+                + (f" WHERE {' AND '.join(conditions)}" if conditions else "")
+                + " ORDER BY rowid",
+                tuple(params),
+            )
+        current_app.logger.info(
+            f"DB: table {table}, export rows of products {product_ids} since {since} until {until}"
+        )
+    except Exception as e:
+        current_app.logger.error(e)
+        error = constants.GENERIC_ERROR_MESSAGE
+
+    return error, rows
@@ -0,0 +1,58 @@
+import time
+
+import click
+from flask.cli import with_appcontext
+
+from booth import api, db
+
+
+@click.command("export")
+@click.argument("table", type=click.Choice(list(db.EXPORT_TABLES)))
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("wb"),
+    default="-",
+    help="File the rows are written to, the standard output by default.",
+)
+@click.option("--format", type=click.Choice(list(api.EXPORT_FORMATS)), default="csv")
+@click.option("--gzip", "compress", is_flag=True, help="Compress the output with gzip.")
+@click.option(
+    "--product-id",
+    "product_ids",
+    multiple=True,
+    help="Only export the rows of this product, can be repeated.",
+)
+@click.option("--since", type=int, help="Timestamp of the oldest exported row.")
+@click.option("--until", type=int, help="Timestamp the exported rows are older than.")
+@with_appcontext
+def export_command(table, output, format, compress, product_ids, since, until):
+    """Stream a table to CSV or NDJSON."""
+    if (since is not None or until is not None) and not db.EXPORT_TABLES[table][1]:
+        raise click.UsageError(f"The {table} table has no timestamps.")
+
+    fields = api.EXPORT_FIELDS[table]
+    error, rows = db.iter_export(table, fields, list(product_ids), since, until)
+    if error or rows is None:
+        raise click.ClickException(error or "Error retrieving data.")
+
+    count = 0
+
+    def counted(rows):
+        nonlocal count
+        for row in rows:
+            count += 1
+            yield row
+
+    start = time.perf_counter()
+    for chunk in api.generate_export(counted(rows), fields, format, compress):
+        output.write(chunk if compress else chunk.encode("utf-8"))
+    output.flush()
+    click.echo(
+        f"Exported {count} rows of {table} in {time.perf_counter() - start:.1f}s.",
+        err=True,
+    )
+
+
+def init_app(app):
+    app.cli.add_command(export_command)
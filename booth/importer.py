@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+import time
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from booth import db, read_int_config, scheduler
+
+
+def read_products(file, format):
+    """
+    Streams the products of a CSV file with a header row, or of a JSONL
+    file, both with name and description fields.
+
+    :return: the line number, and either the product or the reason it is
+        invalid, of each row
+    """
+    if format == "csv":
+        reader = csv.DictReader(file)
+        rows = ((reader.line_num, row) for row in reader)
+    else:
+        rows = (
+            (line_number, line)
+            for line_number, line in enumerate(file, start=1)
+            if line.strip()
+        )
+    for line_number, row in rows:
+        if format != "csv":
+            try:
+                row = json.loads(row)
+            except ValueError:
+                yield line_number, None, "invalid JSON."
+                continue
+        if not isinstance(row, dict):
+            yield line_number, None, "not an object."
+            continue
+        name = str(row.get("name") or "").strip()
+        description = str(row.get("description") or "").strip()
+        if not name:
+            yield line_number, None, "Name is required."
+        elif not description:
+            yield line_number, None, "Description is required."
+        else:
+            yield line_number, {"name": name, "description": description}, None
+
+
+@click.command("import-products")
+@click.argument("file", type=click.File("r", encoding="utf-8"))
+@click.option(
+    "--format",
+    type=click.Choice(["csv", "jsonl"]),
+    help="Format of the file, guessed from its extension by default.",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=500,
+    show_default=True,
+    help="Products added to the db in each transaction.",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    help="Products registered in parallel, REGISTRATION_CONCURRENCY by default.",
+)
+@click.option(
+    "--register/--no-register",
+    default=True,
+    help="Register the products and fetch their offers in the same pass, or"
+    " leave them to the scheduled registration job.",
+)
+@with_appcontext
+def import_products_command(file, format, batch_size, concurrency, register):
+    """Import the products of a CSV or JSONL file.
+
+    Products whose name is already used are skipped, so that an interrupted
+    import can be run again to resume it.
+    """
+    app = current_app._get_current_object()
+    format = format or ("csv" if os.path.splitext(file.name)[1] == ".csv" else "jsonl")
+    concurrency = concurrency or read_int_config(app, "REGISTRATION_CONCURRENCY", 4)
+    counts = {
+        "read": 0,
+        "invalid": 0,
+        "added": 0,
+        "skipped": 0,
+        "registered": 0,
+        "retried": 0,
+        "failed": 0,
+    }
+    start = time.perf_counter()
+
+    def report():
+        elapsed = time.perf_counter() - start
+        click.echo(
+            f"{counts['read']} products read, {counts['added']} added,"
+            f" {counts['registered']} registered in {elapsed:.1f}s"
+            f" ({counts['read'] / elapsed if elapsed else 0:.1f} products/s)."
+        )
+
+    def import_batch(batch):
+        error, added = db.register_products(batch)
+        if error:
+            raise click.ClickException(
+                f"Import aborted: cannot write products to db ({error})."
+                " Run the command again to resume it."
+            )
+        counts["added"] += added
+        counts["skipped"] += len(batch) - added
+        while register:
+            error, registrations = scheduler.register_queued_products(
+                app, batch_size, concurrency
+            )
+            if error:
+                click.echo(f"Registrations left to the scheduled job: {error}", err=True)
+                break
+            if not registrations["claimed"]:
+                break
+            for key in ("registered", "retried", "failed"):
+                counts[key] += registrations[key]
+        report()
+
+    batch = []
+    for line_number, product, error in read_products(file, format):
+        counts["read"] += 1
+        if error:
+            counts["invalid"] += 1
+            click.echo(f"Line {line_number} skipped: {error}", err=True)
+            continue
+        batch.append(product)
+        if len(batch) == batch_size:
+            import_batch(batch)
+            batch = []
+    if batch:
+        import_batch(batch)
+
+    click.echo(
+        f"Import done: {counts['added']} added, {counts['skipped']} already present,"
+        f" {counts['invalid']} invalid; {counts['registered']} registered,"
+        f" {counts['retried']} to retry, {counts['failed']} failed."
+    )
+
+
+def init_app(app):
+    app.cli.add_command(import_products_command)
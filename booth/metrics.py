@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+from flask import Blueprint, Response, g, request
+
+
+bp = Blueprint("metrics", __name__)
+
+# Upper bounds in seconds of the histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: dict):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Monotonically increasing value per combination of labels.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    """
+    Distribution of observed values per combination of labels, counted in
+    cumulative buckets as Prometheus expects.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            bucket_counts, total, count = self._values.get(
+                key, ([0] * len(self.buckets), 0.0, 0)
+            )
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    bucket_counts[i] += 1
+            self._values[key] = (bucket_counts, total + value, count + 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the seconds spent in the block, labels included in the
+        yielded dict can be completed inside the block.
+        """
+        labels = dict(labels)
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(bucket_counts), total, count)
+                for key, (bucket_counts, total, count) in self._values.items()
+            }
+        for key, (bucket_counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                yield f"{self.name}_bucket", {**labels, "le": bound}, bucket_count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "booth_db_query_seconds",
+    "Duration of the db queries.",
+    ["operation", "table"],
+)
+OFFERS_API_REQUEST_SECONDS = REGISTRY.histogram(
+    "booth_offers_api_request_seconds",
+    "Duration of the requests to the offers API.",
+    ["endpoint", "status"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "booth_http_request_seconds",
+    "Duration of the requests served by booth.",
+    ["endpoint", "method", "status"],
+)
+JOB_RUN_SECONDS = REGISTRY.histogram(
+    "booth_job_run_seconds",
+    "Duration of the scheduler job runs.",
+    ["job"],
+)
+JOB_PRODUCTS_TOTAL = REGISTRY.counter(
+    "booth_job_products_total",
+    "Products processed by the scheduler jobs.",
+    ["job"],
+)
+JOB_OFFERS_TOTAL = REGISTRY.counter(
+    "booth_job_offers_total",
+    "Offers changed by the scheduler jobs.",
+    ["job", "change"],
+)
+
+
+def timed_job(job):
+    """
+    Observes the duration of each run of the decorated scheduler job.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            with JOB_RUN_SECONDS.time(job=job):
+                return func(*args, **kwargs)
+
+        return wrapped
+
+    return decorator
+
+
+@bp.route("/metrics")
+def metrics():
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def start_request_timer():
+    g.metrics_request_start = time.perf_counter()
+
+
+def observe_request(response):
+    start = g.pop("metrics_request_start", None)
+    if start is not None:
+        HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            endpoint=request.endpoint or "unknown",
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+
+def init_app(app):
+    app.before_request(start_request_timer)
+    app.after_request(observe_request)
+    app.register_blueprint(bp)
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS offers_product_id ON offers (product_id);
@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS price_history_product_id_timestamp ON price_history (product_id, timestamp);
@@ -0,0 +1,42 @@
+-- Rollup tiers of price_history: each row aggregates the records of a product
+-- in the bucket starting at timestamp. mean_price is the average of the mean
+-- prices, min_price the lowest minimum price and max_price the highest mean price.
+
+CREATE TABLE IF NOT EXISTS price_history_hourly (
+	product_id TEXT NOT NULL,
+	timestamp INTEGER NOT NULL,
+	mean_price REAL NOT NULL,
+	min_price INTEGER NOT NULL,
+	max_price INTEGER NOT NULL,
+	sample_count INTEGER NOT NULL,
+	PRIMARY KEY (product_id, timestamp),
+	FOREIGN KEY (product_id) REFERENCES products (id)
+);
+
+CREATE TABLE IF NOT EXISTS price_history_daily (
+	product_id TEXT NOT NULL,
+	timestamp INTEGER NOT NULL,
+	mean_price REAL NOT NULL,
+	min_price INTEGER NOT NULL,
+	max_price INTEGER NOT NULL,
+	sample_count INTEGER NOT NULL,
+	PRIMARY KEY (product_id, timestamp),
+	FOREIGN KEY (product_id) REFERENCES products (id)
+);
+
+-- Existing records are folded into both tiers, so that they remain readable
+-- once the raw ones older than their retention are pruned.
+
+INSERT OR IGNORE INTO price_history_hourly
+	(product_id, timestamp, mean_price, min_price, max_price, sample_count)
+SELECT product_id, timestamp - timestamp % 3600,
+	AVG(mean_price), MIN(min_price), MAX(mean_price), COUNT(*)
+FROM price_history
+GROUP BY 1, 2;
+
+INSERT OR IGNORE INTO price_history_daily
+	(product_id, timestamp, mean_price, min_price, max_price, sample_count)
+SELECT product_id, timestamp - timestamp % 86400,
+	AVG(mean_price), MIN(min_price), MAX(mean_price), COUNT(*)
+FROM price_history
+GROUP BY 1, 2;
@@ -0,0 +1,9 @@
+-- Version of the data behind each cached view, bumped by every write.
+-- Scopes: "catalogue", "offers:<product_id>", "history:<product_id>" and
+-- "history" for writes touching the history of every product.
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+	scope TEXT PRIMARY KEY,
+	version INTEGER NOT NULL,
+	updated_at INTEGER NOT NULL
+);
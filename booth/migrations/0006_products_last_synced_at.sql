@@ -0,0 +1,4 @@
+-- Timestamp of the last successful offers sync of each product, NULL if never synced
+ALTER TABLE products ADD COLUMN last_synced_at INTEGER;
+
+CREATE INDEX IF NOT EXISTS products_last_synced_at ON products (last_synced_at, id);
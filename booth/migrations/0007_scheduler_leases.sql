@@ -0,0 +1,8 @@
+-- Lease of each scheduler job: only the owner, a process identified by
+-- "<hostname>:<pid>", runs the job until the lease expires.
+
+CREATE TABLE IF NOT EXISTS scheduler_leases (
+	job TEXT PRIMARY KEY,
+	owner TEXT NOT NULL,
+	expires_at REAL NOT NULL
+);
@@ -0,0 +1,16 @@
+-- Registration of each product to the offers API, processed in the
+-- background. Status: "pending", "running", "done" or "failed"; failed
+-- registrations are kept after their product was deleted.
+
+CREATE TABLE IF NOT EXISTS registration_jobs (
+	product_id TEXT PRIMARY KEY,
+	status TEXT NOT NULL,
+	attempts INTEGER NOT NULL DEFAULT 0,
+	error TEXT,
+	next_attempt_at INTEGER NOT NULL,
+	created_at INTEGER NOT NULL,
+	updated_at INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS registration_jobs_status_next_attempt_at
+	ON registration_jobs (status, next_attempt_at);
@@ -0,0 +1,3 @@
+-- The price history tick rolls up and touches the records of a single
+-- timestamp, and the prune deletes the records older than the retention.
+CREATE INDEX IF NOT EXISTS price_history_timestamp ON price_history (timestamp);
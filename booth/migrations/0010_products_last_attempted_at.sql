@@ -0,0 +1,10 @@
+-- Timestamp of the last offers sync attempt of each product, successful or
+-- not, NULL if never attempted: the sync goes through the products in this
+-- order, so that the products failing to sync do not hold back the others.
+ALTER TABLE products ADD COLUMN last_attempted_at INTEGER;
+
+UPDATE products SET last_attempted_at = last_synced_at;
+
+DROP INDEX IF EXISTS products_last_synced_at;
+
+CREATE INDEX IF NOT EXISTS products_last_attempted_at ON products (last_attempted_at, id);
@@ -1,57 +1,232 @@
+import base64
+from contextlib import contextmanager
 import json
 import os
+import tempfile
+import threading
+import time
 from flask import current_app
 
-from booth import offers_api
+from booth import offers_api, read_int_config
+from booth.cache import SingleFlight
 
+try:
+    import fcntl
+except ImportError:  # Windows: the token file is only locked within the process
+    fcntl = None
 
-# FIXME: this mechanism is not easily scalable and requires a specific
-# implementation pattern in each function calling the offers API.
-# A more sophisticated solution relying on the JWT expiration could be preferred.
-def evaluate_and_renovate_token(error) -> tuple[str | None, bool]:
+
+def _get_token_claim(token, claim):
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))[claim])
+    except Exception:
+        return None
+
+
+def get_token_expiry(token):
+    """
+    :return: the exp claim of a JWT, None if the token is not a JWT or has
+        no expiry
+    """
+    return _get_token_claim(token, "exp")
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class AccessTokenManager:
+    """
+    Keeps the access token to the offers API, refreshing it before it
+    expires. A single thread of the process refreshes it at a time, the
+    others wait and reuse the new token. The token is persisted to a file
+    under an exclusive lock, so that the processes sharing the file also
+    share the token instead of each refreshing its own.
+
+    :param token_file: JSON file the token is persisted to
+    :param access_token: token to start with
+    :param refresh_margin: seconds before its expiry a token is refreshed,
+        at most half of its lifetime so that short-lived tokens are used too
+    """
+
+    def __init__(self, token_file, access_token=None, refresh_margin=60):
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._token = access_token or None
+        self._lock = threading.Lock()
+        # Last token without an iat claim and when it was first seen
+        self._seen = (None, None)
+
+    def _get_margin(self, token, expiry):
+        issued_at = _get_token_claim(token, "iat")
+        if issued_at is None:
+            # Lifetime unknown: the one left when the token was first seen
+            if self._seen[0] != token:
+                self._seen = (token, time.time())
+            issued_at = self._seen[1]
+        return max(min(self.refresh_margin, (expiry - issued_at) / 2), 0)
+
+    def _is_fresh(self, token):
+        if not token:
+            return False
+        expiry = get_token_expiry(token)
+        if expiry is None:
+            return True
+        return time.time() < expiry - self._get_margin(token, expiry)
+
+    def _read_file(self):
+        try:
+            with open(self.token_file) as f:
+                return json.load(f).get("OFFERS_ACCESS_TOKEN")
+        except (OSError, ValueError):
+            return None
+
+    def _write_file(self, token):
+        # Written aside then renamed, so that readers never see a partial file
+        with tempfile.NamedTemporaryFile(
+            "w",
+            dir=os.path.dirname(self.token_file),
+            prefix=".offers_access_token.",
+            delete=False,
+        ) as f:
+            json.dump({"OFFERS_ACCESS_TOKEN": token}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f.name, self.token_file)
+
+    def get_token(self) -> tuple[str | None, str | None]:
+        """
+        :return: a token which is not about to expire, refreshed if needed
+        """
+        token = self._token
+        if self._is_fresh(token):
+            return None, token
+        error, refreshed_token = self.refresh(token)
+        if error and token and time.time() < get_token_expiry(token):
+            # Still valid for a while: the refresh is attempted again next time
+            return None, token
+        return error, refreshed_token
+
+    def refresh(self, stale_token) -> tuple[str | None, str | None]:
+        """
+        Replaces stale_token, unless another thread or process already did.
+        """
+        with self._lock:
+            if self._token != stale_token and self._is_fresh(self._token):
+                return None, self._token
+            os.makedirs(os.path.dirname(self.token_file), exist_ok=True)
+            with _file_lock(f"{self.token_file}.lock"):
+                file_token = self._read_file()
+                if file_token != stale_token and self._is_fresh(file_token):
+                    self._token = file_token
+                    return None, file_token
+                error, token = offers_api.fetch_access_token(
+                    current_app.config["OFFERS_BASEURL"],
+                    current_app.config["OFFERS_REFRESH_TOKEN"],
+                )
+                if error or not token:
+                    return error, None
+                self._write_file(token)
+            self._token = token
+            current_app.logger.info("Offers access token refreshed.")
+            return None, token
+
+
+def get_token_manager() -> AccessTokenManager:
+    return current_app.extensions["offers_token"]
+
+
+def evaluate_and_renovate_token(error, stale_token=None) -> tuple[str | None, bool]:
     """
     Checks if the obtained error is a "bad authentication" error;
     if that is the case, renovate the access token using the refresh token.
 
     :param error: the error obtained calling the offers API
+    :param stale_token: the token rejected by the offers API
     """
     if error != offers_api.BAD_OFFERS_AUTHENTICATION_ERROR_MESSAGE:
         return error, False
-    baseurl = current_app.config["OFFERS_BASEURL"]
-    refresh_token = current_app.config["OFFERS_REFRESH_TOKEN"]
-    error, access_token = offers_api.fetch_access_token(baseurl, refresh_token)
-    if access_token and not error:
-        token_file = os.path.join(current_app.instance_path, "offers_access_token.json")
-        with open(token_file, "w") as f:
-            json.dump({"OFFERS_ACCESS_TOKEN": access_token}, f)
-        current_app.config.update(OFFERS_ACCESS_TOKEN=access_token)
-        return error, True
-    return error, False
+    manager = get_token_manager()
+    error, access_token = manager.refresh(stale_token or manager.get_token()[1])
+    return error, bool(access_token and not error)
 
 
-def register_product(product_id, name, description):
-    op = lambda: offers_api.register_product(
+def _register_product(product_id, name, description):
+    op = lambda access_token: offers_api.register_product(
         current_app.config["OFFERS_BASEURL"],
-        current_app.config["OFFERS_ACCESS_TOKEN"],
+        access_token,
         product_id,
         name,
         description,
     )
-    error = op()
-    error, retry = evaluate_and_renovate_token(error)
+    error, access_token = get_token_manager().get_token()
+    if error:
+        return error
+    error = op(access_token)
+    error, retry = evaluate_and_renovate_token(error, access_token)
     if retry:
-        error = op()
+        error = op(get_token_manager().get_token()[1])
     return error
 
 
-def get_offers(product_id):
-    op = lambda: offers_api.get_offers(
+def _get_offers(product_id):
+    op = lambda access_token: offers_api.get_offers(
         current_app.config["OFFERS_BASEURL"],
-        current_app.config["OFFERS_ACCESS_TOKEN"],
+        access_token,
         product_id,
     )
-    error, offers = op()
-    error, retry = evaluate_and_renovate_token(error)
+    error, access_token = get_token_manager().get_token()
+    if error:
+        return error, None
+    error, offers = op(access_token)
+    error, retry = evaluate_and_renovate_token(error, access_token)
     if retry:
-        error, offers = op()
+        error, offers = op(get_token_manager().get_token()[1])
     return error, offers
+
+
+def register_product(product_id, name, description):
+    """
+    Concurrent registrations of the same product share one upstream request.
+    """
+    return current_app.extensions["offers_flight"].do(
+        ("register_product", product_id),
+        lambda: _register_product(product_id, name, description),
+        memoize=lambda error: False,
+    )
+
+
+def get_offers(product_id):
+    """
+    Concurrent calls for the same product share one upstream request, and
+    its successful result is reused for OFFERS_MEMO_TTL_SECONDS.
+    """
+    return current_app.extensions["offers_flight"].do(
+        ("get_offers", product_id),
+        lambda: _get_offers(product_id),
+        memoize=lambda result: result[0] is None,
+    )
+
+
+def init_app(app):
+    app.extensions["offers_token"] = AccessTokenManager(
+        app.config["OFFERS_ACCESS_TOKEN_PATH"]
+        or os.path.join(app.instance_path, "offers_access_token.json"),
+        access_token=app.config["OFFERS_ACCESS_TOKEN"],
+        refresh_margin=read_int_config(app, "OFFERS_TOKEN_REFRESH_MARGIN_SECONDS", 60),
+    )
+    app.extensions["offers_flight"] = SingleFlight(
+        ttl=read_int_config(app, "OFFERS_MEMO_TTL_SECONDS", 2),
+        max_size=read_int_config(app, "OFFERS_MEMO_SIZE", 1024),
+    )
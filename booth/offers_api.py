@@ -1,18 +1,95 @@
 from flask import current_app
 import requests
+from requests.adapters import HTTPAdapter
 from urllib.parse import quote_plus, urljoin
 
+from booth import metrics
 from booth.constants import GENERIC_ERROR_MESSAGE
 
 
 BAD_OFFERS_AUTHENTICATION_ERROR_MESSAGE = "Bad authentication to offers service."
 
 
+class OffersClient:
+    """
+    HTTP client for the offers API, keeping alive a pool of connections
+    shared by every thread of the process.
+
+    :param pool_size: maximum number of connections kept alive per host
+    :param connect_timeout: seconds to wait for a connection to be established
+    :param read_timeout: seconds to wait for the server to send data
+    :param compress: whether to ask the server for compressed responses
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30, compress=True):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(
+            {"Accept-Encoding": "gzip, deflate" if compress else "identity"}
+        )
+
+    def request(self, method, url, endpoint, **kwargs):
+        """
+        :param endpoint: name of the endpoint, used to label the metrics
+        """
+        with metrics.OFFERS_API_REQUEST_SECONDS.time(
+            endpoint=endpoint, status="error"
+        ) as labels:
+            r = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            labels["status"] = r.status_code
+        return r
+
+    def get(self, url, endpoint="", **kwargs):
+        return self.request("GET", url, endpoint, **kwargs)
+
+    def post(self, url, endpoint="", **kwargs):
+        return self.request("POST", url, endpoint, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+_default_client: OffersClient | None = None
+
+
+def get_client() -> OffersClient:
+    """
+    Returns the client of the current app, or a process wide default one
+    when used outside of an app context.
+    """
+    global _default_client
+    if current_app and "offers_client" in current_app.extensions:
+        return current_app.extensions["offers_client"]
+    if _default_client is None:
+        _default_client = OffersClient()
+    return _default_client
+
+
+def init_app(app):
+    try:
+        client = OffersClient(
+            pool_size=int(app.config["OFFERS_POOL_SIZE"]),
+            connect_timeout=float(app.config["OFFERS_CONNECT_TIMEOUT_SECONDS"]),
+            read_timeout=float(app.config["OFFERS_READ_TIMEOUT_SECONDS"]),
+            compress=str(app.config["OFFERS_COMPRESSION"]).lower()
+            in ("1", "true", "yes"),
+        )
+    except Exception:
+        app.logger.error(
+            "Error parsing the offers client configuration, using defaults"
+        )
+        client = OffersClient()
+    app.extensions["offers_client"] = client
+
+
 def fetch_access_token(baseurl, refresh_token):
     endpoint = "/api/v1/auth"
     url = urljoin(baseurl, endpoint)
     headers = {"Bearer": refresh_token}
-    r = requests.post(url, headers=headers)
+    r = get_client().post(url, endpoint="auth", headers=headers)
     if current_app:
         current_app.logger.info(f"POST {url}: {r.status_code}")
     error: str | None = None
@@ -32,7 +109,9 @@ def register_product(baseurl, access_token, product_id, name, description):
     url = urljoin(baseurl, endpoint)
     headers = {"Bearer": access_token}
     request_data = {"id": product_id, "name": name, "description": description}
-    r = requests.post(url, headers=headers, json=request_data)
+    r = get_client().post(
+        url, endpoint="register_product", headers=headers, json=request_data
+    )
     if current_app:
         current_app.logger.info(f"POST {url}: {r.status_code}, {r.text}")
     error = None
@@ -50,7 +129,7 @@ def get_offers(baseurl, access_token, product_id):
     endpoint = f"/api/v1/products/{quote_plus(product_id)}/offers"
     url = urljoin(baseurl, endpoint)
     headers = {"Bearer": access_token}
-    r = requests.get(url, headers=headers)
+    r = get_client().get(url, endpoint="get_offers", headers=headers)
     if current_app:
         current_app.logger.info(f"GET {url}: {r.status_code}, {r.text}")
     error: str | None = None
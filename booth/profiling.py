@@ -0,0 +1,93 @@
+from contextlib import contextmanager
+import cProfile
+import os
+import pstats
+import random
+import re
+import time
+
+from flask import current_app, g, request
+
+from booth import read_int_config
+
+
+PROFILE_HEADER = "X-Booth-Profile"
+
+
+def is_enabled():
+    return str(current_app.config["PROFILING_ENABLED"]).lower() in ("1", "true", "yes")
+
+
+def should_sample():
+    try:
+        sample_rate = float(current_app.config["PROFILING_SAMPLE_RATE"])
+    except Exception:
+        current_app.logger.error(
+            f"Error parsing PROFILING_SAMPLE_RATE: {current_app.config['PROFILING_SAMPLE_RATE']}, using default of 0"
+        )
+        sample_rate = 0
+    return random.random() < sample_rate
+
+
+def get_profiles_folder():
+    return current_app.config["PROFILING_FOLDER"] or os.path.join(
+        current_app.instance_path, "profiles"
+    )
+
+
+def save_profile(profiler, name):
+    """
+    Writes the stats of the profiler to <name>.prof, loadable with pstats,
+    and the top PROFILING_TOP_N functions by cumulative time to <name>.txt.
+    """
+    folder = get_profiles_folder()
+    os.makedirs(folder, exist_ok=True)
+    name = re.sub(r"[^\w.-]", "_", name)
+    path = os.path.join(folder, f"{int(time.time() * 1000)}-{name}")
+    profiler.dump_stats(f"{path}.prof")
+    with open(f"{path}.txt", "w") as f:
+        stats = pstats.Stats(profiler, stream=f)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+            read_int_config(current_app, "PROFILING_TOP_N", 30)
+        )
+    current_app.logger.info(f"Profile of {name} saved to {path}.prof")
+
+
+@contextmanager
+def profiled(name, force=False):
+    """
+    Profiles the block when profiling is enabled and the run is sampled,
+    or when forced.
+    """
+    if not is_enabled() or not (force or should_sample()):
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        save_profile(profiler, name)
+
+
+def start_request_profiler():
+    if not is_enabled():
+        return
+    # Logged in users can ask to profile a request regardless of sampling
+    forced = bool(request.headers.get(PROFILE_HEADER)) and g.get("user") is not None
+    if forced or should_sample():
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def stop_request_profiler(e=None):
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.disable()
+        save_profile(profiler, f"request-{request.endpoint or 'unknown'}")
+
+
+def init_app(app):
+    app.before_request(start_request_profiler)
+    app.teardown_request(stop_request_profiler)
@@ -1,29 +1,203 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask_apscheduler import APScheduler
+import functools
+import math
+import os
+import signal
+import socket
+import sqlite3
+import threading
 import time
 
-from booth import db, offers
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+
+from booth import db, metrics, offers, profiling, read_int_config
 
 
 app_scheduler = APScheduler()
 
 
-def find_offer(offers_list, id):
-    for offer in offers_list:
-        if offer["id"] == id:
-            return offer
+OFFER_FIELDS = ("product_id", "price", "items_in_stock")
+
+
+def get_lease_owner():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def get_job_intervals(app):
+    """
+    :return: the seconds between two runs of each job
+    """
+    sync_interval_seconds = read_int_config(app, "OFFERS_SYNC_INTERVAL_SECONDS", 60)
+    sync_slices = max(read_int_config(app, "OFFERS_SYNC_SLICES", 10), 1)
+    return {
+        "sync_offers": max(sync_interval_seconds / sync_slices, 1),
+        "update_price_history": read_int_config(
+            app, "UPDATE_PRICE_HISTORY_INTERVAL_SECONDS", 60
+        ),
+        "prune_price_history": read_int_config(
+            app, "PRUNE_PRICE_HISTORY_INTERVAL_SECONDS", 300
+        ),
+        "process_registrations": read_int_config(
+            app, "REGISTRATION_INTERVAL_SECONDS", 5
+        ),
+    }
+
+
+def _renew_lease(app, job, owner, ttl_seconds, stop):
+    """
+    Renews the lease of a running job every third of its ttl until stop is
+    set, so that a job running longer than the ttl keeps it.
+    """
+    while not stop.wait(ttl_seconds / 3):
+        with app.app_context():
+            error, acquired = db.acquire_lease(job, owner, ttl_seconds)
+        if error or not acquired:
+            app.logger.warning(f"Job {job} lost its lease while running.")
+
+
+def single_runner(job):
+    """
+    Runs the decorated scheduler job only in the process holding its lease,
+    so that a single process among all the ones sharing the db runs it.
+    The lease is renewed while the job runs and at its end, and expires
+    after the holder missed SCHEDULER_LEASE_MISSED_RUNS runs, letting
+    another process take over.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(local_scheduler: APScheduler | None = None):
+            scheduler = local_scheduler or app_scheduler
+            if not scheduler.app:
+                return
+            ttl_seconds = get_job_intervals(scheduler.app)[job] * max(
+                read_int_config(scheduler.app, "SCHEDULER_LEASE_MISSED_RUNS", 3), 1
+            )
+            owner = get_lease_owner()
+            with scheduler.app.app_context():
+                error, acquired = db.acquire_lease(job, owner, ttl_seconds)
+            if error or not acquired:
+                scheduler.app.logger.debug(f"Job {job} skipped: lease held elsewhere.")
+                return
+            stop = threading.Event()
+            heartbeat = threading.Thread(
+                target=_renew_lease,
+                args=(scheduler.app, job, owner, ttl_seconds, stop),
+                name=f"lease-{job}",
+                daemon=True,
+            )
+            heartbeat.start()
+            try:
+                return func(local_scheduler)
+            finally:
+                stop.set()
+                heartbeat.join()
+                # The lease runs from the end of the job, however long it took
+                with scheduler.app.app_context():
+                    db.acquire_lease(job, owner, ttl_seconds)
+
+        return wrapped
+
+    return decorator
+
+
+def _release_leases(app):
+    with app.app_context():
+        for job in get_job_intervals(app):
+            db.release_lease(job, get_lease_owner())
+
+
+def diff_offers(product_id, current_offers, updated_offers):
+    """
+    Computes the changes turning the current offers of a product into the
+    updated ones, indexing both sides by offer id.
+
+    :return: the offers to insert, the offers to update and the ids of the
+        offers to delete
+    """
+    current_by_id = {offer["id"]: offer for offer in current_offers}
+    updated_by_id = {
+        offer["id"]: {
+            "id": offer["id"],
+            "product_id": product_id,
+            "price": offer["price"],
+            "items_in_stock": offer["items_in_stock"],
+        }
+        for offer in updated_offers
+    }
+    inserted, updated = [], []
+    for id, offer in updated_by_id.items():
+        current_offer = current_by_id.get(id)
+        if current_offer is None:
+            inserted.append(offer)
+        elif any(current_offer[field] != offer[field] for field in OFFER_FIELDS):
+            updated.append(offer)
+    deleted_ids = [id for id in current_by_id if id not in updated_by_id]
+    return inserted, updated, deleted_ids
+
+
+def _fetch_product_offers(app, product_id):
+    """
+    Fetches the offers of a product from the offers API.
+    Runs in a worker thread, hence it needs its own app context.
+    """
+    with app.app_context():
+        return offers.get_offers(product_id)
+
+
+def _apply_product_offers(product_id, updated_offers):
+    error, current_offers = db.get_product_offers(product_id)
+    if error or current_offers is None:
+        return "cannot get product offers from db."
+    inserted, updated, deleted_ids = diff_offers(
+        product_id, current_offers, updated_offers
+    )
+    if not (inserted or updated or deleted_ids):
+        return None
+    try:
+        with db.transaction():
+            error = db.delete_offers(deleted_ids) or db.upsert_offers(
+                inserted + updated
+            )
+            if error:
+                raise sqlite3.DatabaseError(error)
+    except sqlite3.DatabaseError:
+        return "cannot write product offers to db."
+    metrics.JOB_OFFERS_TOTAL.inc(len(inserted), job="sync_offers", change="added")
+    metrics.JOB_OFFERS_TOTAL.inc(len(updated), job="sync_offers", change="updated")
+    metrics.JOB_OFFERS_TOTAL.inc(
+        len(deleted_ids), job="sync_offers", change="deleted"
+    )
     return None
 
 
+@single_runner("sync_offers")
+@metrics.timed_job("sync_offers")
 def sync_offers(local_scheduler: APScheduler | None = None):
     """
+    Syncs one slice of the catalogue, the 1 / OFFERS_SYNC_SLICES of the
+    registered products attempted the longest time ago, so that every
+    product is synced once per OFFERS_SYNC_INTERVAL_SECONDS with a flat load,
+    even while others keep failing.
+    The offers are fetched concurrently, using at most OFFERS_SYNC_CONCURRENCY
+    threads, and the changes are applied to the db from the calling thread only.
+
     :param local_scheduler: used for tests
     """
     scheduler = local_scheduler or app_scheduler
     if not scheduler.app:
         return
-    with scheduler.app.app_context():
+    with scheduler.app.app_context(), profiling.profiled("sync_offers"):
         scheduler.app.logger.info("Syncing offers...")
-        error, products = db.get_all_products()
+        slices = max(read_int_config(scheduler.app, "OFFERS_SYNC_SLICES", 10), 1)
+        error, count = db.count_syncable_products()
+        products = None
+        if not error:
+            error, products = db.get_stalest_products(math.ceil(count / slices))
         if products == []:
             scheduler.app.logger.info("No products to sync.")
             return
@@ -32,54 +206,50 @@ def sync_offers(local_scheduler: APScheduler | None = None):
                 "Offers sync aborted: cannot get products from db."
             )
             return
-        for product in products:
-            error, updated_offers = offers.get_offers(product["id"])
-            if error or not updated_offers:
-                scheduler.app.logger.info(
-                    "Offers sync aborted: cannot get product offers from API."
-                )
-                return
-            error, current_offers = db.get_product_offers(product["id"])
-            if error or not current_offers:
-                scheduler.app.logger.info(
-                    "Offers sync aborted: cannot get product offers from db."
-                )
-                return
-            # Remove offers that do not exist anymore
-            for current_offer in current_offers:
-                if not any(
-                    [offer["id"] == current_offer["id"] for offer in updated_offers]
-                ):
-                    db.delete_offer(current_offer["id"])
-            for updated_offer in updated_offers:
-                updated_offer["product_id"] = product["id"]
-                existing_offer = next(
-                    (
-                        offer
-                        for offer in current_offers
-                        if offer["id"] == updated_offer["id"]
-                    ),
-                    None,
-                )
-                # Add new offers
-                if not existing_offer:
-                    error = db.add_offer(
-                        updated_offer["id"],
-                        updated_offer["product_id"],
-                        updated_offer["price"],
-                        updated_offer["items_in_stock"],
+        concurrency = max(
+            read_int_config(scheduler.app, "OFFERS_SYNC_CONCURRENCY", 8), 1
+        )
+        now = int(time.time())
+        start = time.perf_counter()
+        synced_ids, failed_ids = [], []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                executor.submit(
+                    _fetch_product_offers, scheduler.app, product["id"]
+                ): product
+                for product in products
+            }
+            for future in as_completed(futures):
+                product = futures[future]
+                try:
+                    error, updated_offers = future.result()
+                except Exception as e:
+                    scheduler.app.logger.error(e)
+                    error, updated_offers = str(e), None
+                if error or updated_offers is None:
+                    error = "cannot get product offers from API."
+                else:
+                    error = _apply_product_offers(product["id"], updated_offers)
+                if error:
+                    scheduler.app.logger.info(
+                        f"Offers sync skipped product {product['id']}: {error}"
                     )
+                    failed_ids.append(product["id"])
                     continue
-                # Update changed offers
-                if existing_offer != updated_offer:
-                    db.update_offer(
-                        updated_offer["id"],
-                        updated_offer["product_id"],
-                        updated_offer["price"],
-                        updated_offer["items_in_stock"],
-                    )
+                synced_ids.append(product["id"])
+        db.mark_products_synced(synced_ids, now, failed_ids)
+        synced = len(synced_ids)
+        metrics.JOB_PRODUCTS_TOTAL.inc(synced, job="sync_offers")
+        elapsed = time.perf_counter() - start
+        scheduler.app.logger.info(
+            f"Offers synced for {synced} products ({len(failed_ids)} failed) in {elapsed:.2f}s, "
+            f"{len(products) / elapsed if elapsed else 0:.1f} products/s "
+            f"with concurrency {concurrency}."
+        )
 
 
+@single_runner("update_price_history")
+@metrics.timed_job("update_price_history")
 def update_price_history(local_scheduler: APScheduler | None = None):
     """
     :param local_scheduler: used for tests
@@ -87,92 +257,289 @@ def update_price_history(local_scheduler: APScheduler | None = None):
     scheduler = local_scheduler or app_scheduler
     if not scheduler.app:
         return
-    with scheduler.app.app_context():
+    with scheduler.app.app_context(), profiling.profiled("update_price_history"):
         scheduler.app.logger.info("Updating price history...")
 
         now = int(time.time())
+        start = time.perf_counter()
 
-        error, products = db.get_all_products()
-        if products == []:
-            scheduler.app.logger.info("No products for updating the price history.")
-            return
-        if error or products is None:
+        try:
+            with db.transaction():
+                error, count = db.add_price_records_from_offers(now)
+                if not error:
+                    error = db.update_price_history_rollups(now)
+                if error:
+                    raise sqlite3.DatabaseError(error)
+        except sqlite3.DatabaseError:
             scheduler.app.logger.info(
-                "Updating the price history aborted: cannot get products from db."
+                "Updating the price history aborted: cannot write price records to db."
             )
             return
-        if not products:
+        metrics.JOB_PRODUCTS_TOTAL.inc(count, job="update_price_history")
+        scheduler.app.logger.info(
+            f"Price history updated for {count} products in {time.perf_counter() - start:.3f}s."
+        )
+
+
+@single_runner("prune_price_history")
+@metrics.timed_job("prune_price_history")
+def prune_price_history(local_scheduler: APScheduler | None = None):
+    """
+    Deletes the raw and hourly price records older than their retention,
+    and, when MAX_PRODUCT_RECORDS is set, the oldest raw records exceeding
+    it per product.
+
+    :param local_scheduler: used for tests
+    """
+    scheduler = local_scheduler or app_scheduler
+    if not scheduler.app:
+        return
+    with scheduler.app.app_context(), profiling.profiled("prune_price_history"):
+        scheduler.app.logger.info("Pruning price history...")
+        max_product_records = read_int_config(
+            scheduler.app, "MAX_PRODUCT_RECORDS", 0
+        )
+        raw_retention_seconds = read_int_config(
+            scheduler.app, "PRICE_HISTORY_RAW_RETENTION_SECONDS", 172800
+        )
+        hourly_retention_seconds = read_int_config(
+            scheduler.app, "PRICE_HISTORY_HOURLY_RETENTION_SECONDS", 7776000
+        )
+        try:
+            with db.transaction():
+                error, count = db.prune_expired_price_history(
+                    raw_retention_seconds, hourly_retention_seconds
+                )
+                if not error and max_product_records > 0:
+                    error, capped_count = db.prune_price_history(max_product_records)
+                    count += capped_count or 0
+                if error:
+                    raise sqlite3.DatabaseError(error)
+        except sqlite3.DatabaseError:
             scheduler.app.logger.info(
-                "Updating the price history interrupted: there are no products."
+                "Pruning the price history aborted: cannot delete price records from db."
             )
             return
-        for product in products:
-            error, offers = db.get_product_offers(product["id"])
-            if error or not offers:
-                scheduler.app.logger.info(
-                    "Updating the price history aborted: cannot get product offers from db."
+        scheduler.app.logger.info(f"Price history pruned: {count} records deleted.")
+
+
+def _register_product(app, product_id, name, description):
+    """
+    Registers a product to the offers API and fetches its first offers.
+    Runs in a worker thread, hence it needs its own app context.
+
+    :return: the registration error, and the offers of the product, None if
+        they could not be fetched
+    """
+    with app.app_context():
+        error = offers.register_product(product_id, name, description)
+        if error:
+            return error, None
+        error, product_offers = offers.get_offers(product_id)
+        return None, product_offers if not error else None
+
+
+def _fail_registration(product_id, error):
+    """
+    Deletes the product whose registration failed for good.
+    """
+    try:
+        with db.transaction():
+            if db.delete_product(product_id) or db.finish_registration_job(
+                product_id, "failed", error
+            ):
+                raise sqlite3.DatabaseError(error)
+    except sqlite3.DatabaseError:
+        return "cannot delete product from db."
+    return None
+
+
+def register_queued_products(app, limit, concurrency):
+    """
+    Registers at most limit queued products to the offers API and adds their
+    first offers, using at most concurrency threads. A failed registration is
+    attempted again with an exponential backoff from
+    REGISTRATION_RETRY_DELAY_SECONDS; after REGISTRATION_MAX_ATTEMPTS
+    attempts its product is deleted.
+
+    :return: the number of claimed, registered, retried and failed products
+    """
+    counts = {"claimed": 0, "registered": 0, "retried": 0, "failed": 0}
+    max_attempts = read_int_config(app, "REGISTRATION_MAX_ATTEMPTS", 5)
+    retry_delay_seconds = read_int_config(app, "REGISTRATION_RETRY_DELAY_SECONDS", 10)
+    error, jobs = db.claim_registration_jobs(
+        limit, read_int_config(app, "REGISTRATION_CLAIM_TIMEOUT_SECONDS", 300)
+    )
+    if error:
+        return "cannot get registrations from db.", None
+    counts["claimed"] = len(jobs)
+
+    with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+        futures = {}
+        for job in jobs:
+            if job["name"] is None:
+                db.finish_registration_job(
+                    job["product_id"],
+                    "failed",
+                    "Product deleted before its registration.",
                 )
+                counts["failed"] += 1
                 continue
-            min_price = offers[0]["price"]
-            total_price = 0
-            total_quantity = 0
-            for offer in offers:
-                total_price += offer["price"] * offer["items_in_stock"]
-                total_quantity += offer["items_in_stock"]
-                if offer["price"] < min_price:
-                    min_price = offer["price"]
-            mean_price = total_price / total_quantity
-
-            db.add_price_record(now, product["id"], mean_price, min_price)
-
-            # Allow a maximum number of records per product
+            future = executor.submit(
+                _register_product,
+                app,
+                job["product_id"],
+                job["name"],
+                job["description"],
+            )
+            futures[future] = job
+        for future in as_completed(futures):
+            job = futures[future]
+            product_id = job["product_id"]
             try:
-                max_product_records = int(scheduler.app.config["MAX_PRODUCT_RECORDS"])
-            except Exception:
-                scheduler.app.logger.error(
-                    f"Error parsing MAX_PRODUCT_RECORDS: {scheduler.app.config['MAX_PRODUCT_RECORDS']}, using default of 100"
+                error, product_offers = future.result()
+            except Exception as e:
+                app.logger.error(e)
+                error, product_offers = str(e), None
+            if not error:
+                # Upserted in case a previous attempt died after adding
+                # them, offers missing here are added by the next sync
+                if product_offers:
+                    db.upsert_offers(
+                        [{**offer, "product_id": product_id} for offer in product_offers]
+                    )
+                db.finish_registration_job(product_id, "done")
+                counts["registered"] += 1
+            elif job["attempts"] + 1 < max_attempts:
+                db.finish_registration_job(
+                    product_id,
+                    "pending",
+                    error,
+                    int(time.time()) + retry_delay_seconds * 2 ** job["attempts"],
                 )
-                max_product_records = 100
-            if len(offers) + 1 > max_product_records:
-                db.delete_oldest_price_record(product["id"])
+                counts["retried"] += 1
+            else:
+                app.logger.info(f"Registration of product {product_id} failed: {error}")
+                delete_error = _fail_registration(product_id, error)
+                if delete_error:
+                    app.logger.info(
+                        f"Registration of product {product_id} not compensated: {delete_error}"
+                    )
+                counts["failed"] += 1
+    metrics.JOB_PRODUCTS_TOTAL.inc(counts["registered"], job="process_registrations")
+    return None, counts
 
 
-def init_app(app):
-    if not app.config["TESTING"]:
-        try:
-            sync_interval_seconds = int(app.config["OFFERS_SYNC_INTERVAL_SECONDS"])
-        except Exception:
-            app.logger.error(
-                f"Error parsing OFFERS_SYNC_INTERVAL_SECONDS: {app.config['OFFERS_SYNC_INTERVAL_SECONDS']}, using default of 60 seconds"
-            )
-            sync_interval_seconds = 60
-        try:
-            update_history_interval_seconds = int(
-                app.config["UPDATE_PRICE_HISTORY_INTERVAL_SECONDS"]
-            )
-        except Exception:
-            app.logger.error(
-                f"Error parsing UPDATE_PRICE_HISTORY_INTERVAL_SECONDS: {app.config['UPDATE_PRICE_HISTORY_INTERVAL_SECONDS']}, using default of 60 seconds"
-            )
-            update_history_interval_seconds = 60
-        app.config.from_mapping(
-            JOBS=[
-                {
-                    "id": "sync_offers",
-                    "func": sync_offers,
-                    "trigger": "interval",
-                    "seconds": sync_interval_seconds,
-                },
-                {
-                    "id": "update_price_history",
-                    "func": update_price_history,
-                    "trigger": "interval",
-                    "seconds": update_history_interval_seconds,
-                },
-            ]
+@single_runner("process_registrations")
+@metrics.timed_job("process_registrations")
+def process_registrations(local_scheduler: APScheduler | None = None):
+    """
+    Registers the queued products to the offers API, at most
+    REGISTRATION_BATCH_SIZE per run, using at most REGISTRATION_CONCURRENCY
+    threads.
+
+    :param local_scheduler: used for tests
+    """
+    scheduler = local_scheduler or app_scheduler
+    if not scheduler.app:
+        return
+    with scheduler.app.app_context(), profiling.profiled("process_registrations"):
+        error, counts = register_queued_products(
+            scheduler.app,
+            read_int_config(scheduler.app, "REGISTRATION_BATCH_SIZE", 20),
+            read_int_config(scheduler.app, "REGISTRATION_CONCURRENCY", 4),
         )
+        if error:
+            scheduler.app.logger.info(f"Processing registrations aborted: {error}")
+            return
+        if counts["claimed"]:
+            scheduler.app.logger.info(
+                f"Registrations processed: {counts['registered']} registered, "
+                f"{counts['retried']} to retry, {counts['failed']} failed."
+            )
+
 
-        app_scheduler.init_app(app)
-        app_scheduler.start()
-        app_scheduler.run_job("sync_offers")
-        app_scheduler.run_job("update_price_history")
+def is_enabled(app):
+    return str(app.config["SCHEDULER_ENABLED"]).lower() in ("1", "true", "yes")
+
+
+def start(app):
+    intervals = get_job_intervals(app)
+    sync_jitter_seconds = read_int_config(app, "OFFERS_SYNC_JITTER_SECONDS", 1)
+    app.config.from_mapping(
+        JOBS=[
+            {
+                "id": "sync_offers",
+                "func": sync_offers,
+                "trigger": "interval",
+                "seconds": intervals["sync_offers"],
+                "jitter": sync_jitter_seconds,
+            },
+            {
+                "id": "update_price_history",
+                "func": update_price_history,
+                "trigger": "interval",
+                "seconds": intervals["update_price_history"],
+            },
+            {
+                "id": "prune_price_history",
+                "func": prune_price_history,
+                "trigger": "interval",
+                "seconds": intervals["prune_price_history"],
+            },
+            {
+                "id": "process_registrations",
+                "func": process_registrations,
+                "trigger": "interval",
+                "seconds": intervals["process_registrations"],
+            },
+        ]
+    )
+
+    app_scheduler.init_app(app)
+    app_scheduler.start()
+    # Let the other processes take over the jobs without waiting for the
+    # leases to expire when this one stops
+    atexit.register(_release_leases, app)
+    app_scheduler.run_job("sync_offers")
+    app_scheduler.run_job("update_price_history")
+
+
+def _wait_for_stop():
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+
+
+@click.command("worker")
+@with_appcontext
+def worker_command():
+    """Run the scheduled jobs until stopped, without serving requests."""
+    app = current_app._get_current_object()
+    if not app_scheduler.running:
+        start(app)
+    click.echo("Worker started, press CTRL+C to stop.")
+    try:
+        _wait_for_stop()
+    finally:
+        if app_scheduler.running:
+            app_scheduler.shutdown()
+    click.echo("Worker stopped.")
+
+
+def _is_serving():
+    """
+    :return: whether the app is loaded to serve requests, by a WSGI server
+        or by the run command, rather than to run another CLI command
+    """
+    ctx = click.get_current_context(silent=True)
+    return ctx is None or ctx.info_name == "run"
+
+
+def init_app(app):
+    app.cli.add_command(worker_command)
+    if not app.config["TESTING"] and is_enabled(app) and _is_serving():
+        start(app)
@@ -4,7 +4,7 @@ from flask_apscheduler import APScheduler
 
 import pytest
 from booth import create_app, scheduler as booth_scheduler
-from booth.db import get_db, init_db
+from booth.db import close_pool, get_db, init_db
 
 with open(os.path.join(os.path.dirname(__file__), "data.sql"), "rb") as f:
     _data_sql = f.read().decode("utf-8")
@@ -26,6 +26,9 @@ def app():
             "OFFERS_BASEURL": TEST_BASEURL,
             "OFFERS_REFRESH_TOKEN": TEST_REFRESH_TOKEN,
             "OFFERS_ACCESS_TOKEN": TEST_ACCESS_TOKEN,
+            "OFFERS_ACCESS_TOKEN_PATH": f"{db_path}.token.json",
+            "OFFERS_SYNC_SLICES": "1",
+            "OFFERS_MEMO_TTL_SECONDS": "0",
         }
     )
 
@@ -35,8 +38,12 @@ def app():
 
     yield app
 
+    with app.app_context():
+        close_pool()
     os.close(db_fd)
-    os.unlink(db_path)
+    for path in (db_path, f"{db_path}.token.json", f"{db_path}.token.json.lock"):
+        if os.path.exists(path):
+            os.unlink(path)
 
 
 @pytest.fixture
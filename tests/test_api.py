@@ -0,0 +1,130 @@
+import gzip
+import json
+
+import pytest
+
+from booth import api, db
+
+
+def test_login_required(client):
+    response = client.get("/api/v1/products")
+    assert response.status_code == 401
+    assert response.json == {"error": "Authentication required."}
+
+
+def test_products(client, auth):
+    auth.login()
+    response = client.get("/api/v1/products")
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert response.json == [
+        {"id": "b", "name": "Carrot", "description": "Another vegetable."},
+        {"id": "a", "name": "Onion", "description": "A vegetable."},
+    ]
+
+
+def test_products_ndjson(client, auth):
+    auth.login()
+    response = client.get("/api/v1/products?fields=id,name&format=ndjson")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in response.data.splitlines()] == [
+        {"id": "b", "name": "Carrot"},
+        {"id": "a", "name": "Onion"},
+    ]
+
+    response = client.get(
+        "/api/v1/products?fields=id", headers={"Accept": "application/x-ndjson"}
+    )
+    assert response.mimetype == "application/x-ndjson"
+
+
+def test_invalid_fields(client, auth):
+    auth.login()
+    response = client.get("/api/v1/products?fields=id,password")
+    assert response.status_code == 400
+
+
+def test_product(client, auth):
+    auth.login()
+    response = client.get("/api/v1/products/a")
+    assert response.json == {"id": "a", "name": "Onion", "description": "A vegetable."}
+    response = client.get("/api/v1/products/z")
+    assert response.status_code == 404
+    response = client.get("/api/v1/products/z/offers")
+    assert response.status_code == 404
+
+
+def test_offers(client, auth, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_CHUNK_ROWS", 2)
+    auth.login()
+    response = client.get("/api/v1/products/a/offers?fields=id,price")
+    assert response.json == [
+        {"id": "1", "price": 100},
+        {"id": "2", "price": 200},
+        {"id": "3", "price": 300},
+    ]
+
+
+@pytest.mark.parametrize(("since", "timestamp"), (("", 1000), ("?since=0", 0)))
+def test_history(client, app, auth, since, timestamp):
+    with app.app_context():
+        db.add_price_records_from_offers(1000)
+        db.update_price_history_rollups(1000)
+
+    auth.login()
+    response = client.get(f"/api/v1/products/b/history{since}")
+    assert response.json == [
+        {"timestamp": timestamp, "product_id": "b", "mean_price": 50, "min_price": 50},
+    ]
+
+
+def test_registration(client, app, auth):
+    with app.app_context():
+        _, product_id = db.register_product("Apple", "A fruit.")
+    auth.login()
+    response = client.get(f"/api/v1/registrations/{product_id}")
+    assert response.json["status"] == "pending"
+    assert response.json["attempts"] == 0
+    response = client.get("/api/v1/registrations/z")
+    assert response.status_code == 404
+
+
+def test_export(client, auth, monkeypatch):
+    monkeypatch.setattr(api, "STREAM_CHUNK_ROWS", 2)
+    auth.login()
+    response = client.get("/api/v1/export/offers?product_id=a&fields=id,price")
+    assert response.mimetype == "text/csv"
+    assert response.headers["Content-Disposition"] == 'attachment; filename="offers.csv"'
+    assert response.data.decode().splitlines() == ["id,price", "1,100", "2,200", "3,300"]
+
+
+def test_export_price_history_gzip(client, app, auth):
+    with app.app_context():
+        for timestamp in (1000, 2000, 3000):
+            db.add_price_records_from_offers(timestamp)
+
+    auth.login()
+    response = client.get(
+        "/api/v1/export/price_history?format=ndjson&compress=gzip"
+        "&product_id=b&since=2000&until=3000"
+    )
+    assert response.mimetype == "application/gzip"
+    assert [
+        json.loads(line) for line in gzip.decompress(response.data).splitlines()
+    ] == [{"timestamp": 2000, "product_id": "b", "mean_price": 50, "min_price": 50}]
+
+
+@pytest.mark.parametrize(
+    ("query", "status_code"),
+    (
+        ("users", 404),
+        ("products?format=xml", 400),
+        ("products?fields=password", 400),
+        ("offers?since=1000", 400),
+    ),
+)
+def test_export_invalid(client, auth, query, status_code):
+    auth.login()
+    response = client.get(f"/api/v1/export/{query}")
+    assert response.status_code == status_code
@@ -63,3 +63,18 @@ def test_logout(client, auth):
     with client:
         auth.logout()
         assert "user_id" not in session
+
+
+def test_logged_in_user_cache(client, auth, monkeypatch):
+    auth.login()
+    client.get("/")
+
+    def fail(**_):
+        raise AssertionError("Unexpected query")
+
+    monkeypatch.setattr("booth.db.get_user", fail)
+    with client:
+        client.get("/")
+        assert g.user["username"] == "test"
+        client.get("/static/style.css")
+        assert g.user is None
@@ -0,0 +1,40 @@
+from benchmarks import run
+
+
+def test_compare():
+    baseline = {
+        "results": {
+            "10": {
+                "sync_offers": {"min": 0.9, "median": 1.0},
+                "render_index": {"min": 0.9, "median": 1.0},
+            }
+        }
+    }
+    results = {
+        "10": {
+            "sync_offers": {"min": 1.4, "median": 1.5},
+            "render_index": {"min": 0.4, "median": 0.5},
+            "render_history": {"min": 9.0, "median": 10.0},
+        }
+    }
+
+    assert run.compare(results, baseline, 0.2) == [("10", "sync_offers", 1.0, 1.5, 1.5)]
+    assert run.compare(results, baseline, 0.6) == []
+    assert run.compare(results, {}, 0.2) == []
+
+
+def test_run_size():
+    args = run.parse_args(["--offers", "2", "--history", "3", "--repeat", "1"])
+
+    results = run.run_size(5, args)
+
+    assert set(results) == {
+        "sync_offers",
+        "update_price_history",
+        "get_price_history",
+        "render_index",
+        "render_index_cached",
+        "render_history",
+    }
+    for result in results.values():
+        assert 0 <= result["min"] <= result["median"]
@@ -1,10 +1,9 @@
 import re
-from urllib.parse import urljoin
 import requests_mock
 import pytest
 
+from booth import db
 from booth.db import get_db
-from tests import conftest
 
 
 EMPTY_PRODUCT = {"id": "", "name": "", "description": ""}
@@ -41,7 +40,7 @@ def get_failing_db():
     return {"execute": throw}
 
 
-def test_index(client, auth, monkeypatch):
+def test_index(client, app, auth, monkeypatch):
     response = client.get("/")
     assert b"Log In" in response.data
     assert b"Register" in response.data
@@ -53,39 +52,35 @@ def test_index(client, auth, monkeypatch):
     assert b"Register" in response.data
 
     auth.login()
-    monkeypatch.setattr("booth.db.get_all_products", lambda: ("Test error", None))
+    monkeypatch.setattr("booth.db.get_products_page", lambda **_: ("Test error", None))
+    app.extensions["response_cache"].clear()
     response = client.get("/")
     assert b"Test error" in response.data
 
 
 def test_register(client, app, auth, monkeypatch):
     with requests_mock.Mocker() as m:
-        monkeypatch.setattr("uuid.uuid4", lambda: "test-uuid")
-
-        auth.login()
-        m.post(
-            urljoin(conftest.TEST_BASEURL, "/api/v1/products/register"),
-            request_headers={"Bearer": conftest.TEST_ACCESS_TOKEN},
-            status_code=201,
-        )
-        matcher = re.compile("/api/v1/products/.+/offers")
-        auth.login()
-        m.get(
-            matcher,
-            request_headers={"Bearer": conftest.TEST_ACCESS_TOKEN},
-            status_code=200,
-            text="[]"
-        )
-
         auth.login()
         assert client.get("/register").status_code == 200
         auth.login()
-        client.post("/register", data={"name": "Apple", "description": "A fruit."})
+        response = client.post(
+            "/register", data={"name": "Apple", "description": "A fruit."}
+        )
 
+        # The offers API is only called by the registration job
+        assert m.call_count == 0
         with app.app_context():
-            db = get_db()
-            count = db.execute("SELECT COUNT(id) FROM products").fetchone()[0]
-            assert count == 3
+            product = get_db().execute(
+                "SELECT p.id, j.status FROM products p"
+                " JOIN registration_jobs j ON j.product_id = p.id"
+                " WHERE p.name = 'Apple'"
+            ).fetchone()
+            assert product["status"] == "pending"
+        assert response.headers["Location"] == f"/{product['id']}/registration"
+
+        auth.login()
+        response = client.get(response.headers["Location"])
+        assert b"Registering the product to the offers service" in response.data
 
         auth.login()
         response = client.post(
@@ -103,6 +98,23 @@ def test_register(client, app, auth, monkeypatch):
         assert b"Test error" in response.data
 
 
+def test_registration(client, app, auth):
+    auth.login()
+    response = client.get("/a/registration")
+    assert response.headers["Location"] == "/"
+
+    with app.app_context():
+        get_db().execute(
+            "INSERT INTO registration_jobs"
+            " (product_id, status, attempts, error, next_attempt_at, created_at, updated_at)"
+            " VALUES ('deleted', 'failed', 5, 'Something went wrong.', 0, 0, 0)"
+        )
+        get_db().commit()
+    auth.login()
+    response = client.get("/deleted/registration")
+    assert b"Registration failed: Something went wrong." in response.data
+
+
 def test_edit(client, app, auth, monkeypatch):
     auth.login()
     assert client.get("/a/edit").status_code == 200
@@ -178,3 +190,89 @@ def test_product_offers(client, auth):
     response = client.get("/a/offers")
     assert response.status_code == 200
     assert b'100' in response.data
+
+
+@pytest.mark.parametrize("span", ("", "day", "year"))
+def test_product_history(client, app, auth, span):
+    with app.app_context():
+        get_db().execute(
+            "INSERT INTO price_history (timestamp, product_id, mean_price, min_price)"
+            " VALUES (strftime('%s', 'now'), 'a', 150, 100)"
+        )
+        get_db().commit()
+
+    auth.login()
+    response = client.get(f"/a/history?span={span}")
+    assert response.status_code == 200
+    assert b"Price history for product: Onion" in response.data
+
+
+def test_product_history_latest_records(client, app, auth):
+    app.config["HISTORY_LATEST_RECORDS"] = "2"
+    with app.app_context():
+        get_db().executemany(
+            "INSERT INTO price_history (timestamp, product_id, mean_price, min_price)"
+            " VALUES (?, 'a', ?, 100)",
+            [(1000, 111), (2000, 222), (3000, 333)],
+        )
+        get_db().commit()
+
+    auth.login()
+    response = client.get("/a/history")
+    assert b"111" not in response.data
+    assert b"&#34;data&#34;: [222, 333]" in response.data
+
+
+def test_index_pagination(client, app, auth):
+    app.config["PRODUCTS_PAGE_SIZE"] = "1"
+    auth.login()
+    response = client.get("/")
+    assert b"Carrot" in response.data
+    assert b"Onion" not in response.data
+    assert b"Previous" not in response.data
+    next_url = re.search(rb'href="(/\?after=[^"]+)"', response.data)[1].decode()
+
+    response = client.get(next_url)
+    assert b"Onion" in response.data
+    assert b"Carrot" not in response.data
+    assert b"Next" not in response.data
+    prev_url = re.search(rb'href="(/\?before=[^"]+)"', response.data)[1].decode()
+
+    response = client.get(prev_url)
+    assert b"Carrot" in response.data
+    assert b"Onion" not in response.data
+    assert b"Previous" not in response.data
+
+
+def test_cached_views(client, app, auth, monkeypatch):
+    auth.login()
+    for path in ("/", "/a/offers", "/a/history"):
+        response = client.get(path)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+
+        response = client.get(path, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.data == b""
+
+    # Unchanged data is served from the cache without hitting the views
+    monkeypatch.setattr("booth.db.get_products_page", lambda **_: ("Test error", None))
+    response = client.get("/")
+    assert response.status_code == 200
+    assert b"Onion" in response.data
+
+    # Writes invalidate the cached views reading the changed data
+    etag = client.get("/a/offers").headers["ETag"]
+    with app.app_context():
+        db.add_offer("5", "a", 400, 1)
+    response = client.get("/a/offers", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert b"400" in response.data
+
+    etag = client.get("/b/offers").headers["ETag"]
+    with app.app_context():
+        db.update_product("b", "Carrot", "An orange vegetable.")
+    response = client.get("/b/offers", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    response = client.get("/")
+    assert b"Test error" in response.data
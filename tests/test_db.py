@@ -1,10 +1,14 @@
 import sqlite3
+import threading
+import time
 
 import pytest
-from booth.db import get_db
+from booth import db
+from booth.db import close_pool, get_db
 
 
 def test_get_close_db(app):
+    app.config["DATABASE_POOL"] = "false"
     with app.app_context():
         db = get_db()
         assert db is get_db()
@@ -15,6 +19,47 @@ def test_get_close_db(app):
     assert "closed" in str(e.value)
 
 
+def test_get_pooled_db(app):
+    with app.app_context():
+        db = get_db()
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert db.execute("PRAGMA synchronous").fetchone()[0] == 1
+        assert db.execute("PRAGMA busy_timeout").fetchone()[0] == 5000
+        db.execute("DELETE FROM offers")
+
+    # The connection is reused by the next context, without the open transaction
+    with app.app_context():
+        assert get_db() is db
+        assert not db.in_transaction
+        assert db.execute("SELECT COUNT(id) FROM offers").fetchone()[0] == 4
+
+        close_pool()
+
+    with pytest.raises(sqlite3.ProgrammingError):
+        db.execute("SELECT 1")
+
+
+def test_pooled_db_closed_with_thread(app):
+    pool = app.extensions["db_pool"]
+    size = pool.size()
+    connections = []
+
+    def use_db():
+        with app.app_context():
+            connections.append(get_db())
+            db.acquire_lease("job", "owner", 60)
+
+    for _ in range(5):
+        thread = threading.Thread(target=use_db)
+        thread.start()
+        thread.join()
+
+    assert pool.size() == size
+    for connection in connections:
+        with pytest.raises(sqlite3.ProgrammingError):
+            connection.execute("SELECT 1")
+
+
 def test_init_db_command(runner, monkeypatch):
     class Recorder(object):
         called = False
@@ -26,3 +71,185 @@ def test_init_db_command(runner, monkeypatch):
     result = runner.invoke(args=["init-db"])
     assert "Initialized" in result.output
     assert Recorder.called
+
+
+def test_transaction(app):
+    with app.app_context():
+        with db.transaction():
+            db.add_offers(
+                [
+                    {"id": "5", "product_id": "b", "price": 60, "items_in_stock": 1},
+                    {"id": "6", "product_id": "b", "price": 70, "items_in_stock": 2},
+                ]
+            )
+            db.upsert_offers(
+                [{"id": "4", "product_id": "b", "price": 55, "items_in_stock": 3}]
+            )
+            db.delete_offers(["5"])
+            assert get_db().in_transaction
+
+        assert not get_db().in_transaction
+        _, offers = db.get_product_offers("b")
+        assert [dict(offer) for offer in offers] == [
+            {"id": "4", "product_id": "b", "price": 55, "items_in_stock": 3},
+            {"id": "6", "product_id": "b", "price": 70, "items_in_stock": 2},
+        ]
+
+        with pytest.raises(Exception):
+            with db.transaction():
+                db.delete_offers(["4", "6"])
+                raise Exception("Test error")
+
+        _, offers = db.get_product_offers("b")
+        assert len(offers) == 2
+
+
+def test_init_db_migrations(app):
+    with app.app_context():
+        assert db.get_schema_version() == db._list_migrations()[-1][0]
+        indexes = [
+            row["name"]
+            for row in get_db().execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        ]
+        assert "offers_product_id" in indexes
+        assert "price_history_product_id_timestamp" in indexes
+
+        # Migrating an up to date database is a no-op
+        assert db.init_db() == []
+
+
+def test_init_db_upgrade_keeps_data(app):
+    with app.app_context():
+        get_db().executescript(
+            "DROP TABLE schema_version;"
+            " DROP INDEX offers_product_id;"
+            " DROP INDEX price_history_product_id_timestamp;"
+            " DROP INDEX products_last_attempted_at;"
+            " ALTER TABLE products DROP COLUMN last_synced_at;"
+            " ALTER TABLE products DROP COLUMN last_attempted_at;"
+        )
+
+        assert db.init_db() == [
+            filename for _, _, filename in db._list_migrations()
+        ]
+        count = get_db().execute("SELECT COUNT(id) FROM offers").fetchone()[0]
+        assert count == 4
+
+
+def test_init_db_upgrade_rolls_up_history(app):
+    with app.app_context():
+        now = int(time.time())
+        start = now - now % 86400 - 30 * 86400
+        get_db().executescript(
+            "DROP TABLE schema_version;"
+            " DROP TABLE price_history_hourly;"
+            " DROP TABLE price_history_daily;"
+            " DROP INDEX products_last_attempted_at;"
+            " ALTER TABLE products DROP COLUMN last_synced_at;"
+            " ALTER TABLE products DROP COLUMN last_attempted_at;"
+        )
+        # A tick every hour over 30 days, written before the rollup tiers existed
+        get_db().executemany(
+            "INSERT INTO price_history (timestamp, product_id, mean_price, min_price)"
+            " VALUES (?, 'a', 150, 100)",
+            [(timestamp,) for timestamp in range(start, start + 30 * 86400, 3600)],
+        )
+        get_db().commit()
+
+        db.init_db()
+        assert db.prune_expired_price_history(172800, 7776000)[0] is None
+
+        _, history_a = db.get_price_history("a", since=start)
+        assert len(history_a) == 30 * 24
+        assert history_a[0]["timestamp"] == start
+        daily = get_db().execute(
+            "SELECT timestamp, sample_count FROM price_history_daily"
+            " WHERE product_id = 'a' ORDER BY timestamp"
+        ).fetchall()
+        assert [tuple(row) for row in daily] == [
+            (start + day * 86400, 24) for day in range(30)
+        ]
+
+
+def test_init_db_concurrent(app, monkeypatch):
+    with app.app_context():
+        # Another process applied the migrations after this one read the version
+        get_schema_version = db.get_schema_version
+        stale_versions = [0]
+        monkeypatch.setattr(
+            db,
+            "get_schema_version",
+            lambda: stale_versions.pop() if stale_versions else get_schema_version(),
+        )
+
+        assert db.init_db() == []
+        assert get_schema_version() == db._list_migrations()[-1][0]
+
+
+@pytest.mark.parametrize(
+    ("age", "expected_table"),
+    (
+        (3600, "price_history"),
+        (30 * 86400, "price_history_hourly"),
+        (365 * 86400, "price_history_daily"),
+    ),
+)
+def test_get_price_history_tier(app, age, expected_table):
+    now = int(time.time())
+    with app.app_context():
+        get_db().execute(
+            f"INSERT INTO {expected_table} (timestamp, product_id, mean_price, min_price"
+            + (", max_price, sample_count" if expected_table != "price_history" else "")
+            + ") VALUES (?, 'a', 150, 100"
+            + (", 200, 1" if expected_table != "price_history" else "")
+            + ")",
+            (now - age + 60,),
+        )
+        get_db().commit()
+
+        error, price_history = db.get_price_history("a", since=now - age)
+        assert error is None
+        assert [record["mean_price"] for record in price_history] == [150]
+
+
+def test_acquire_lease(app, monkeypatch):
+    with app.app_context():
+        assert db.acquire_lease("job", "first", 60) == (None, True)
+        assert db.acquire_lease("job", "second", 60) == (None, False)
+        assert db.acquire_lease("job", "first", 60) == (None, True)
+
+        # The lease expired: another owner takes it over
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 61)
+        assert db.acquire_lease("job", "second", 60) == (None, True)
+        assert db.acquire_lease("job", "first", 60) == (None, False)
+
+        assert db.release_lease("job", "second") is None
+        assert db.acquire_lease("job", "first", 60) == (None, True)
+
+
+def test_claim_registration_jobs(app, monkeypatch):
+    with app.app_context():
+        _, product_id = db.register_product("Apple", "A fruit.")
+        error, jobs = db.claim_registration_jobs(10, 300)
+        assert error is None
+        assert [job["product_id"] for job in jobs] == [product_id]
+
+        # Still running: not claimed again before the claim timeout
+        now = time.time()
+        monkeypatch.setattr(time, "time", lambda: now + 299)
+        assert db.claim_registration_jobs(10, 300) == (None, [])
+
+        # Left running by a dead worker: claimed again
+        monkeypatch.setattr(time, "time", lambda: now + 301)
+        _, jobs = db.claim_registration_jobs(10, 300)
+        assert [job["attempts"] for job in jobs] == [1]
+
+        # A failed attempt is due after its retry delay
+        db.finish_registration_job(product_id, "pending", "error", int(now) + 310)
+        assert db.claim_registration_jobs(10, 300) == (None, [])
+        monkeypatch.setattr(time, "time", lambda: now + 311)
+        _, jobs = db.claim_registration_jobs(10, 300)
+        assert [job["attempts"] for job in jobs] == [2]
@@ -0,0 +1,39 @@
+import gzip
+import json
+
+
+def test_export_command(runner, tmp_path):
+    result = runner.invoke(args=["export", "products"])
+    assert result.exit_code == 0
+    assert result.stdout.splitlines() == [
+        "id,name,description",
+        "a,Onion,A vegetable.",
+        "b,Carrot,Another vegetable.",
+    ]
+    assert "Exported 2 rows of products" in result.stderr
+
+    path = tmp_path / "offers.ndjson.gz"
+    result = runner.invoke(
+        args=[
+            "export",
+            "offers",
+            "--format",
+            "ndjson",
+            "--gzip",
+            "--product-id",
+            "b",
+            "-o",
+            str(path),
+        ]
+    )
+    assert result.exit_code == 0
+    lines = gzip.decompress(path.read_bytes()).splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {"id": "4", "product_id": "b", "price": 50, "items_in_stock": 8}
+    ]
+
+
+def test_export_command_invalid_time_range(runner):
+    result = runner.invoke(args=["export", "products", "--since", "1000"])
+    assert result.exit_code == 2
+    assert "The products table has no timestamps." in result.output
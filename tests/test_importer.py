@@ -0,0 +1,71 @@
+import json
+import re
+
+import requests_mock
+
+from booth import db
+from booth.db import get_db
+from tests import conftest
+
+
+def mock_offers_api(m, register_status=201):
+    m.post(
+        conftest.TEST_BASEURL + "/api/v1/products/register",
+        status_code=register_status,
+    )
+    m.get(
+        re.compile(re.escape(conftest.TEST_BASEURL) + "/api/v1/products/.+/offers"),
+        text=json.dumps([]),
+    )
+
+
+def count_registrations(app, status):
+    with app.app_context():
+        return get_db().execute(
+            "SELECT COUNT(*) FROM registration_jobs WHERE status = ?", (status,)
+        ).fetchone()[0]
+
+
+def test_import_products_csv(app, runner, tmp_path):
+    path = tmp_path / "products.csv"
+    path.write_text(
+        "name,description\n"
+        "Apple,A fruit.\n"
+        "Pear,\n"
+        "Onion,Already there.\n"
+        "Plum,Another fruit.\n"
+    )
+    with requests_mock.Mocker() as m:
+        mock_offers_api(m)
+        result = runner.invoke(args=["import-products", str(path), "--batch-size", "2"])
+
+    assert result.exit_code == 0
+    assert "Line 3 skipped: Description is required." in result.output
+    assert (
+        "Import done: 2 added, 1 already present, 1 invalid;"
+        " 2 registered, 0 to retry, 0 failed." in result.output
+    )
+    assert count_registrations(app, "done") == 2
+    with app.app_context():
+        assert db.count_products() == (None, 4)
+
+
+def test_import_products_jsonl_resumes(app, runner, tmp_path):
+    path = tmp_path / "products.jsonl"
+    path.write_text(
+        json.dumps({"name": "Apple", "description": "A fruit."})
+        + "\nnot json\n"
+        + json.dumps({"name": "Plum", "description": "Another fruit."})
+        + "\n"
+    )
+    result = runner.invoke(args=["import-products", str(path), "--no-register"])
+    assert "Line 2 skipped: invalid JSON." in result.output
+    assert "Import done: 2 added, 0 already present, 1 invalid;" in result.output
+    assert count_registrations(app, "pending") == 2
+
+    # Run again: the products are not added twice, and get registered
+    with requests_mock.Mocker() as m:
+        mock_offers_api(m)
+        result = runner.invoke(args=["import-products", str(path)])
+    assert "Import done: 0 added, 2 already present, 1 invalid; 2 registered" in result.output
+    assert count_registrations(app, "done") == 2
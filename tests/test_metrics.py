@@ -0,0 +1,91 @@
+import json
+from urllib.parse import urljoin
+
+import requests_mock
+
+from booth import metrics, scheduler as booth_scheduler
+from tests import conftest
+
+
+def test_registry():
+    registry = metrics.Registry()
+    counter = registry.counter("test_total", "Test counter.", ["kind"])
+    histogram = registry.histogram("test_seconds", "Test histogram.", ["kind"], buckets=(1, 5))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    histogram.observe(3, kind="c")
+
+    assert registry.render() == "\n".join(
+        [
+            "# HELP test_total Test counter.",
+            "# TYPE test_total counter",
+            'test_total{kind="a\\"b"} 3',
+            "# HELP test_seconds Test histogram.",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{kind="c",le="1"} 0',
+            'test_seconds_bucket{kind="c",le="5"} 1',
+            'test_seconds_bucket{kind="c",le="+Inf"} 1',
+            'test_seconds_sum{kind="c"} 3.0',
+            'test_seconds_count{kind="c"} 1',
+        ]
+    ) + "\n"
+
+
+def test_metrics_endpoint(client):
+    client.get("/auth/login")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert (
+        b'booth_http_request_seconds_count{endpoint="auth.login",method="GET",status="200"}'
+        in response.data
+    )
+
+
+def test_job_metrics(app, scheduler):
+    runs = metrics.JOB_RUN_SECONDS.count(job="sync_offers")
+    added = metrics.JOB_OFFERS_TOTAL.value(job="sync_offers", change="added")
+    deleted = metrics.JOB_OFFERS_TOTAL.value(job="sync_offers", change="deleted")
+    requests = metrics.OFFERS_API_REQUEST_SECONDS.count(endpoint="get_offers", status=200)
+    reads = metrics.DB_QUERY_SECONDS.count(operation="read_bulk", table="offers")
+    with app.app_context():
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                status_code=200,
+                text=json.dumps([{"id": "5", "price": 100, "items_in_stock": 1}]),
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/b/offers"),
+                status_code=200,
+                text="[]",
+            )
+
+            booth_scheduler.sync_offers(scheduler)
+
+    assert metrics.JOB_RUN_SECONDS.count(job="sync_offers") == runs + 1
+    assert metrics.JOB_OFFERS_TOTAL.value(job="sync_offers", change="added") == added + 1
+    assert metrics.JOB_OFFERS_TOTAL.value(job="sync_offers", change="deleted") == deleted + 4
+    assert metrics.OFFERS_API_REQUEST_SECONDS.count(endpoint="get_offers", status=200) == requests + 2
+    assert metrics.DB_QUERY_SECONDS.count(operation="read_bulk", table="offers") == reads + 2
+
+
+def test_price_history_query_metrics(app, scheduler):
+    labels = [
+        ("create_from_offers", "price_history"),
+        ("touch", "cache_versions"),
+        ("rollup", "price_history_hourly"),
+        ("rollup", "price_history_daily"),
+        ("acquire_lease", "scheduler_leases"),
+    ]
+    counts = [
+        metrics.DB_QUERY_SECONDS.count(operation=operation, table=table)
+        for operation, table in labels
+    ]
+
+    booth_scheduler.update_price_history(scheduler)
+
+    assert [
+        metrics.DB_QUERY_SECONDS.count(operation=operation, table=table) - count
+        for (operation, table), count in zip(labels, counts)
+    ] == [1, 1, 1, 1, 2]
@@ -1,10 +1,14 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
 import json
 import pytest
 import requests_mock
+import time
 
 from urllib.parse import urljoin
 
 from booth import constants, offers, offers_api
+from booth.cache import SingleFlight
 from tests import conftest
 
 
@@ -53,4 +57,133 @@ def test_evaluate_and_renovate_token(
             )
             error, retry = offers.evaluate_and_renovate_token(offers_api.BAD_OFFERS_AUTHENTICATION_ERROR_MESSAGE)
     assert error == expected_error
-    assert retry == expected_retry
\ No newline at end of file
+    assert retry == expected_retry
+
+
+def make_token(expires_in, lifetime=3600):
+    now = int(time.time())
+    payload = base64.urlsafe_b64encode(
+        json.dumps(
+            {"iat": now + expires_in - lifetime, "exp": now + expires_in}
+        ).encode("utf-8")
+    )
+    return f"e30.{payload.rstrip(b'=').decode('ascii')}."
+
+
+def test_get_token_expiry():
+    token = make_token(300)
+    assert offers.get_token_expiry(token) == pytest.approx(time.time() + 300, abs=2)
+    assert offers.get_token_expiry(conftest.TEST_ACCESS_TOKEN) is None
+
+
+def test_token_refreshed_before_expiry(app):
+    new_token = make_token(3600)
+    with app.app_context():
+        manager = offers.get_token_manager()
+        manager._token = make_token(10)
+        with requests_mock.Mocker() as m:
+            m.post(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/auth"),
+                status_code=201,
+                text=json.dumps({"access_token": new_token}),
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                request_headers={"Bearer": new_token},
+                text="[]",
+            )
+            assert offers.get_offers("a") == (None, [])
+            assert [request.path for request in m.request_history] == [
+                "/api/v1/auth",
+                "/api/v1/products/a/offers",
+            ]
+        with open(manager.token_file) as f:
+            assert json.load(f) == {"OFFERS_ACCESS_TOKEN": new_token}
+
+
+@pytest.mark.parametrize("claims", ({"iat": 0, "exp": 4}, {"exp": 4}))
+def test_short_lived_token_not_refreshed(app, claims):
+    now = int(time.time())
+    payload = base64.urlsafe_b64encode(
+        json.dumps({claim: now + offset for claim, offset in claims.items()}).encode("utf-8")
+    )
+    short_lived_token = f"e30.{payload.rstrip(b'=').decode('ascii')}."
+    with app.app_context():
+        manager = offers.get_token_manager()
+        manager._token = short_lived_token
+        with requests_mock.Mocker() as m:
+            assert manager.get_token() == (None, short_lived_token)
+            assert manager.get_token() == (None, short_lived_token)
+            assert m.call_count == 0
+
+
+def test_token_refreshed_once_by_concurrent_threads(app):
+    stale_token = make_token(-10)
+    with app.app_context():
+        manager = offers.get_token_manager()
+        manager._token = stale_token
+
+    def refresh():
+        with app.app_context():
+            return manager.refresh(stale_token)
+
+    with requests_mock.Mocker() as m:
+        m.post(
+            urljoin(conftest.TEST_BASEURL, "/api/v1/auth"),
+            status_code=201,
+            text=json.dumps({"access_token": make_token(3600)}),
+        )
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: refresh(), range(8)))
+        assert m.call_count == 1
+    assert len(set(results)) == 1
+
+
+def test_token_shared_through_file(app):
+    shared_token = make_token(3600)
+    with app.app_context():
+        manager = offers.get_token_manager()
+        with open(manager.token_file, "w") as f:
+            json.dump({"OFFERS_ACCESS_TOKEN": shared_token}, f)
+        with requests_mock.Mocker() as m:
+            assert manager.refresh(conftest.TEST_ACCESS_TOKEN) == (None, shared_token)
+            assert m.call_count == 0
+
+
+def test_get_offers_coalesced(app):
+    app.extensions["offers_flight"] = SingleFlight(ttl=60)
+
+    def get_offers():
+        with app.app_context():
+            return offers.get_offers("a")
+
+    def slow_offers(request, context):
+        time.sleep(0.2)
+        return "[]"
+
+    with requests_mock.Mocker() as m:
+        m.get(
+            urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+            text=slow_offers,
+        )
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: get_offers(), range(8)))
+        assert results == [(None, [])] * 8
+        assert m.call_count == 1
+
+        # Served from the memo
+        assert get_offers() == (None, [])
+        assert m.call_count == 1
+
+
+def test_get_offers_errors_not_memoized(app):
+    app.extensions["offers_flight"] = SingleFlight(ttl=60)
+    with app.app_context():
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                status_code=500,
+            )
+            assert offers.get_offers("a") == (constants.GENERIC_ERROR_MESSAGE, None)
+            assert offers.get_offers("a") == (constants.GENERIC_ERROR_MESSAGE, None)
+            assert m.call_count == 2
@@ -158,3 +158,25 @@ def test_get_offers(
         error, offers = offers_api.get_offers(conftest.TEST_BASEURL, conftest.TEST_ACCESS_TOKEN, product_id)
     assert error == expected_error
     assert offers == expected_offers
+
+
+def test_offers_client(app):
+    with app.app_context():
+        client = offers_api.get_client()
+        assert client is app.extensions["offers_client"]
+        assert client.timeout == (5.0, 30.0)
+        assert client.session.headers["Accept-Encoding"] == "gzip, deflate"
+
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/test_id/offers"),
+                status_code=200,
+                text="[]",
+            )
+            offers_api.get_offers(conftest.TEST_BASEURL, conftest.TEST_ACCESS_TOKEN, "test_id")
+            assert m.last_request.timeout == (5.0, 30.0)
+
+
+def test_offers_client_without_compression():
+    client = offers_api.OffersClient(compress=False)
+    assert client.session.headers["Accept-Encoding"] == "identity"
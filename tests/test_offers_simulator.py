@@ -0,0 +1,76 @@
+import time
+
+import pytest
+
+from benchmarks.offers_simulator import Simulator, create_simulator_app
+from booth import offers
+
+
+def get_token(client):
+    response = client.post("/api/v1/auth", headers={"Bearer": "refresh"})
+    assert response.status_code == 201
+    return response.get_json()["access_token"]
+
+
+def test_auth_issues_jwt():
+    client = create_simulator_app(Simulator(token_ttl_seconds=300, seed=0)).test_client()
+
+    token = get_token(client)
+
+    assert offers.get_token_expiry(token) == pytest.approx(time.time() + 300, abs=2)
+    response = client.get("/api/v1/products/a/offers", headers={"Bearer": token})
+    assert response.status_code == 200
+
+
+def test_bad_refresh_token():
+    client = create_simulator_app(Simulator(refresh_token="secret", seed=0)).test_client()
+
+    response = client.post("/api/v1/auth", headers={"Bearer": "refresh"})
+    assert response.status_code == 401
+
+
+def test_unknown_token():
+    client = create_simulator_app(Simulator(seed=0)).test_client()
+
+    response = client.get("/api/v1/products/a/offers", headers={"Bearer": "unknown"})
+    assert response.status_code == 401
+    assert client.get("/stats").get_json()["offers 401"] == 1
+
+
+def test_expired_token():
+    client = create_simulator_app(Simulator(token_ttl_seconds=0, seed=0)).test_client()
+    token = get_token(client)
+
+    response = client.get("/api/v1/products/a/offers", headers={"Bearer": token})
+    assert response.status_code == 401
+
+
+def test_error_rate():
+    simulator = Simulator(error_rate=1, seed=0)
+    client = create_simulator_app(simulator).test_client()
+
+    assert client.post("/api/v1/auth").status_code == 500
+    assert client.get("/api/v1/products/a/offers").status_code == 500
+    assert simulator.stats["tokens issued"] == 0
+
+
+def test_churn_respects_offer_bounds():
+    simulator = Simulator(min_offers=2, max_offers=4, churn_rate=0.5, seed=0)
+    client = create_simulator_app(simulator).test_client()
+    token = get_token(client)
+    response = client.post(
+        "/api/v1/products/register", json={"id": "a"}, headers={"Bearer": token}
+    )
+    assert response.status_code == 201
+
+    counts, ids = set(), set()
+    for _ in range(200):
+        response = client.get("/api/v1/products/a/offers", headers={"Bearer": token})
+        offer_ids = {offer["id"] for offer in response.get_json()}
+        counts.add(len(offer_ids))
+        ids |= offer_ids
+
+    assert counts <= {2, 3, 4}
+    # The offers do churn
+    assert len(counts) > 1
+    assert len(ids) > 4
@@ -0,0 +1,43 @@
+import os
+
+from booth import profiling, scheduler as booth_scheduler
+
+
+def test_profiling_disabled(client, app, auth, tmp_path):
+    app.config.update(PROFILING_FOLDER=str(tmp_path), PROFILING_SAMPLE_RATE="1")
+    auth.login()
+    client.get("/", headers={profiling.PROFILE_HEADER: "1"})
+    assert os.listdir(tmp_path) == []
+
+
+def test_profile_request(client, app, auth, tmp_path):
+    app.config.update(
+        PROFILING_ENABLED="true",
+        PROFILING_FOLDER=str(tmp_path),
+        PROFILING_SAMPLE_RATE="0",
+    )
+    client.get("/", headers={profiling.PROFILE_HEADER: "1"})
+    assert os.listdir(tmp_path) == []
+
+    auth.login()
+    client.get("/", headers={profiling.PROFILE_HEADER: "1"})
+    files = sorted(os.listdir(tmp_path))
+    assert [file.split("-", 1)[1] for file in files] == [
+        "request-booth.index.prof",
+        "request-booth.index.txt",
+    ]
+    with open(tmp_path / files[1]) as f:
+        assert "cumulative" in f.read()
+
+
+def test_profile_job(app, scheduler, tmp_path):
+    app.config.update(
+        PROFILING_ENABLED="true",
+        PROFILING_FOLDER=str(tmp_path),
+        PROFILING_SAMPLE_RATE="1",
+    )
+    booth_scheduler.update_price_history(scheduler)
+    assert sorted(file.split("-", 1)[1] for file in os.listdir(tmp_path)) == [
+        "update_price_history.prof",
+        "update_price_history.txt",
+    ]
@@ -1,8 +1,10 @@
+import click
 import json
+import time
 from urllib.parse import urljoin
 import requests_mock
 
-from booth import db, scheduler as booth_scheduler
+from booth import constants, db, scheduler as booth_scheduler
 
 from tests import conftest
 
@@ -45,3 +47,370 @@ def test_sync_offer(app, scheduler):
             assert [dict(offer) for offer in offers_b] == [
                 {"id": "4", "product_id": "b", "price": 50, "items_in_stock": 2},
             ]
+
+
+def test_sync_offer_skips_failing_product(app, scheduler):
+    app.config["OFFERS_SYNC_CONCURRENCY"] = "1"
+    with app.app_context():
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                request_headers={"Bearer": conftest.TEST_ACCESS_TOKEN},
+                status_code=500,
+                text="Server error",
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/b/offers"),
+                request_headers={"Bearer": conftest.TEST_ACCESS_TOKEN},
+                status_code=200,
+                text=json.dumps(MOCK_OFFERS_B),
+            )
+
+            booth_scheduler.sync_offers(scheduler)
+
+            _, offers_a = db.get_product_offers("a")
+            assert offers_a
+            assert [offer["price"] for offer in offers_a] == [100, 200, 300]
+            _, offers_b = db.get_product_offers("b")
+            assert offers_b
+            assert [dict(offer) for offer in offers_b] == [
+                {"id": "4", "product_id": "b", "price": 50, "items_in_stock": 2},
+            ]
+
+
+def test_diff_offers(app):
+    with app.app_context():
+        _, current_offers = db.get_product_offers("a")
+        inserted, updated, deleted_ids = booth_scheduler.diff_offers(
+            "a",
+            current_offers,
+            [
+                {"id": "1", "price": 100, "items_in_stock": 10},
+                {"id": "2", "price": 250, "items_in_stock": 12},
+                {"id": "5", "price": 400, "items_in_stock": 1},
+            ],
+        )
+    assert inserted == [
+        {"id": "5", "product_id": "a", "price": 400, "items_in_stock": 1}
+    ]
+    assert updated == [
+        {"id": "2", "product_id": "a", "price": 250, "items_in_stock": 12}
+    ]
+    assert deleted_ids == ["3"]
+
+
+def test_sync_offer_unchanged(app, scheduler, monkeypatch):
+    def fail(*_):
+        raise AssertionError("Unexpected write")
+
+    monkeypatch.setattr("booth.db.upsert_offers", fail)
+    monkeypatch.setattr("booth.db.delete_offers", fail)
+    with app.app_context():
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                status_code=200,
+                text=json.dumps(
+                    [
+                        {"id": "1", "price": 100, "items_in_stock": 10},
+                        {"id": "2", "price": 200, "items_in_stock": 12},
+                        {"id": "3", "price": 300, "items_in_stock": 17},
+                    ]
+                ),
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/b/offers"),
+                status_code=200,
+                text=json.dumps([{"id": "4", "price": 50, "items_in_stock": 8}]),
+            )
+
+            booth_scheduler.sync_offers(scheduler)
+
+
+def test_update_price_history(app, scheduler):
+    with app.app_context():
+        db.get_db().execute("UPDATE offers SET items_in_stock = 0 WHERE product_id = 'b'")
+        db.get_db().commit()
+
+        booth_scheduler.update_price_history(scheduler)
+
+        _, history_a = db.get_price_history("a")
+        assert len(history_a) == 1
+        assert history_a[0]["mean_price"] == (100 * 10 + 200 * 12 + 300 * 17) / 39
+        assert history_a[0]["min_price"] == 100
+        _, history_b = db.get_price_history("b")
+        assert history_b == []
+
+
+def test_update_price_history_rolls_back(app, scheduler, monkeypatch):
+    monkeypatch.setattr(
+        db, "update_price_history_rollups", lambda timestamp: "Rollup failed"
+    )
+    with app.app_context():
+        booth_scheduler.update_price_history(scheduler)
+
+        _, history_a = db.get_price_history("a")
+        assert history_a == []
+
+
+def test_prune_price_history_keeps_raw_retention(app, scheduler):
+    with app.app_context():
+        now = int(time.time())
+        # A tick every 10 minutes over the last day, past the 100 records of
+        # the former per-product cap
+        timestamps = list(range(now - 86400 + 600, now + 1, 600))
+        for timestamp in timestamps:
+            db.add_price_records_from_offers(timestamp)
+            db.update_price_history_rollups(timestamp)
+
+        booth_scheduler.prune_price_history(scheduler)
+
+        _, history_a = db.get_price_history("a", since=now - 86400)
+        assert [record["timestamp"] for record in history_a] == timestamps
+
+
+def test_prune_price_history_max_product_records(app, scheduler):
+    app.config["MAX_PRODUCT_RECORDS"] = "2"
+    app.config["UPDATE_PRICE_HISTORY_INTERVAL_SECONDS"] = "10"
+    with app.app_context():
+        now = int(time.time())
+        for timestamp in range(now - 4, now):
+            db.add_price_records_from_offers(timestamp)
+            db.update_price_history_rollups(timestamp)
+
+        booth_scheduler.prune_price_history(scheduler)
+
+        _, history_a = db.get_price_history("a")
+        assert [record["timestamp"] for record in history_a] == [now - 2, now - 1]
+        _, history_b = db.get_price_history("b")
+        assert [record["timestamp"] for record in history_b] == [now - 2, now - 1]
+        assert db.prune_price_history(2) == (None, 0)
+
+        # Spans longer than the updates kept are read from the rollups
+        assert db._price_history_table(now - 10) == "price_history"
+        assert db._price_history_table(now - 30) == "price_history_hourly"
+
+
+def test_prune_expired_price_history(app, scheduler):
+    with app.app_context():
+        now = int(time.time())
+        db.add_price_records_from_offers(now - 7 * 86400)
+        db.update_price_history_rollups(now - 7 * 86400)
+        db.add_price_records_from_offers(now)
+
+        booth_scheduler.prune_price_history(scheduler)
+
+        _, history_a = db.get_price_history("a")
+        assert [record["timestamp"] for record in history_a] == [now]
+        _, history_a = db.get_price_history("a", since=now - 8 * 86400)
+        assert len(history_a) == 1
+
+
+def test_update_price_history_rollups(app, scheduler, monkeypatch):
+    with app.app_context():
+        monkeypatch.setattr("time.time", lambda: 7200)
+        booth_scheduler.update_price_history(scheduler)
+        db.get_db().execute("UPDATE offers SET price = 20 WHERE id = '4'")
+        db.get_db().commit()
+        monkeypatch.setattr("time.time", lambda: 7260)
+        booth_scheduler.update_price_history(scheduler)
+
+        for table in ("price_history_hourly", "price_history_daily"):
+            rollup = db.get_db().execute(
+                f"SELECT * FROM {table} WHERE product_id = 'b'"
+            ).fetchone()
+            assert rollup["mean_price"] == 35
+            assert rollup["min_price"] == 20
+            assert rollup["max_price"] == 50
+            assert rollup["sample_count"] == 2
+        assert db.get_db().execute(
+            "SELECT timestamp FROM price_history_hourly WHERE product_id = 'b'"
+        ).fetchone()[0] == 7200
+        assert db.get_db().execute(
+            "SELECT timestamp FROM price_history_daily WHERE product_id = 'b'"
+        ).fetchone()[0] == 0
+
+
+def test_sync_offer_slices(app, scheduler):
+    app.config["OFFERS_SYNC_SLICES"] = "2"
+    with app.app_context():
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                status_code=200,
+                text=json.dumps(MOCK_OFFERS_A),
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/b/offers"),
+                status_code=200,
+                text=json.dumps(MOCK_OFFERS_B),
+            )
+
+            booth_scheduler.sync_offers(scheduler)
+            assert [request.path for request in m.request_history] == [
+                "/api/v1/products/a/offers"
+            ]
+            booth_scheduler.sync_offers(scheduler)
+            assert m.request_history[-1].path == "/api/v1/products/b/offers"
+            booth_scheduler.sync_offers(scheduler)
+            assert m.request_history[-1].path == "/api/v1/products/a/offers"
+
+        last_synced_at = [
+            row[0]
+            for row in db.get_db().execute(
+                "SELECT last_synced_at FROM products ORDER BY id"
+            )
+        ]
+        assert all(last_synced_at)
+
+
+def test_sync_offers_failing_product(app, scheduler):
+    app.config["OFFERS_SYNC_SLICES"] = "2"
+    with app.app_context():
+        db.get_db().execute(
+            "INSERT INTO products (id, name, description)"
+            " VALUES ('c', 'Leek', 'A vegetable.'), ('d', 'Pea', 'A legume.')"
+        )
+        db.get_db().commit()
+        # Waiting for its registration: not synced yet
+        _, pending_id = db.register_product("Apple", "A fruit.")
+
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                status_code=404,
+            )
+            for product_id in ("b", "c", "d"):
+                m.get(
+                    urljoin(conftest.TEST_BASEURL, f"/api/v1/products/{product_id}/offers"),
+                    text="[]",
+                )
+
+            booth_scheduler.sync_offers(scheduler)
+            booth_scheduler.sync_offers(scheduler)
+            paths = sorted(request.path for request in m.request_history)
+            assert paths == [
+                f"/api/v1/products/{product_id}/offers"
+                for product_id in ("a", "b", "c", "d")
+            ]
+            assert f"/api/v1/products/{pending_id}/offers" not in paths
+
+
+def test_sync_offer_lease_held_elsewhere(app, scheduler):
+    with app.app_context():
+        db.acquire_lease("sync_offers", "other-host:1", 60)
+        with requests_mock.Mocker() as m:
+            booth_scheduler.sync_offers(scheduler)
+            assert m.call_count == 0
+
+        db.release_lease("sync_offers", "other-host:1")
+        with requests_mock.Mocker() as m:
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/a/offers"),
+                text=json.dumps(MOCK_OFFERS_A),
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/b/offers"),
+                text=json.dumps(MOCK_OFFERS_B),
+            )
+            booth_scheduler.sync_offers(scheduler)
+            assert m.call_count == 2
+
+
+def test_worker_command(runner, monkeypatch):
+    class Recorder(object):
+        started = False
+
+    def fake_start(app):
+        Recorder.started = True
+
+    monkeypatch.setattr("booth.scheduler.start", fake_start)
+    monkeypatch.setattr("booth.scheduler._wait_for_stop", lambda: None)
+    result = runner.invoke(args=["worker"])
+    assert Recorder.started
+    assert "Worker stopped." in result.output
+
+
+def test_init_app_starts_only_to_serve(app, monkeypatch):
+    started = []
+    monkeypatch.setattr("booth.scheduler.start", started.append)
+    app.config["TESTING"] = False
+
+    booth_scheduler.init_app(app)
+    with click.Context(click.Command("run"), info_name="run"):
+        booth_scheduler.init_app(app)
+    assert started == [app, app]
+
+    with click.Context(click.Command("init-db"), info_name="init-db"):
+        booth_scheduler.init_app(app)
+    assert started == [app, app]
+
+
+def test_process_registrations(app, scheduler):
+    with app.app_context():
+        _, product_id = db.register_product("Apple", "A fruit.")
+        with requests_mock.Mocker() as m:
+            m.post(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/register"),
+                request_headers={"Bearer": conftest.TEST_ACCESS_TOKEN},
+                status_code=201,
+            )
+            m.get(
+                urljoin(conftest.TEST_BASEURL, f"/api/v1/products/{product_id}/offers"),
+                text=json.dumps([{"id": "10", "price": 100, "items_in_stock": 10}]),
+            )
+            booth_scheduler.process_registrations(scheduler)
+
+        _, job = db.get_registration_job(product_id)
+        assert (job["status"], job["attempts"], job["error"]) == ("done", 1, None)
+        _, product_offers = db.get_product_offers(product_id)
+        assert [offer["id"] for offer in product_offers] == ["10"]
+
+        # Nothing left to process
+        with requests_mock.Mocker() as m:
+            booth_scheduler.process_registrations(scheduler)
+            assert m.call_count == 0
+
+
+def test_single_runner_renews_lease_while_running(app, scheduler):
+    app.config["REGISTRATION_INTERVAL_SECONDS"] = "1"
+    app.config["SCHEDULER_LEASE_MISSED_RUNS"] = "1"
+    held_elsewhere = []
+
+    @booth_scheduler.single_runner("process_registrations")
+    def job(local_scheduler):
+        # Runs past the 1s ttl of the lease taken before it started
+        time.sleep(1.5)
+        with app.app_context():
+            held_elsewhere.append(
+                db.acquire_lease("process_registrations", "other-host:1", 1)
+            )
+
+    job(scheduler)
+    assert held_elsewhere == [(None, False)]
+
+
+def test_process_registrations_retry_and_compensate(app, scheduler, monkeypatch):
+    app.config["REGISTRATION_MAX_ATTEMPTS"] = "2"
+    app.config["REGISTRATION_RETRY_DELAY_SECONDS"] = "0"
+    with app.app_context():
+        _, product_id = db.register_product("Apple", "A fruit.")
+        with requests_mock.Mocker() as m:
+            m.post(
+                urljoin(conftest.TEST_BASEURL, "/api/v1/products/register"),
+                status_code=500,
+            )
+            booth_scheduler.process_registrations(scheduler)
+            _, job = db.get_registration_job(product_id)
+            assert (job["status"], job["attempts"]) == ("pending", 1)
+            _, product = db.get_product(product_id)
+            assert product is not None
+
+            booth_scheduler.process_registrations(scheduler)
+            assert m.call_count == 2
+
+        _, job = db.get_registration_job(product_id)
+        assert (job["status"], job["attempts"]) == ("failed", 2)
+        assert job["error"] == constants.GENERIC_ERROR_MESSAGE
+        _, product = db.get_product(product_id)
+        assert product is None